@@ -1,112 +1,122 @@
 import cv2
 import numpy as np
 from sort import Sort  # Ensure the SORT library is available
-import csv
+from blob_detector import BlobDetector
+from overlay import SegmentOverlay
+from track_store import BoundaryLog, write_boundaries_csv
+from trajectory import TrajectoryBuffer, TrajectorySpill
 import sys
 
 class VehicleTracker:
-    def __init__(self):
+    def __init__(self, path_capacity=256, spill_path=None):
+        """
+        Each vehicle keeps its last path_capacity boxes; with a spill_path every
+        box is also appended to that file (see trajectory.load_spill).
+        Boundaries are logged in a track_store.BoundaryLog, see stream_csv().
+        """
         self.tracker = Sort()
-        self.vehicle_dict = {}
-        self.frame_boundaries = []
-        self.road_boundaries = []
-        self.boundaries_left = []
-        self.boundaries_right = []
-        self.global_min_left = None
-        self.global_max_left = None
-        self.global_min_right = None
-        self.global_max_right = None
+        self.path_capacity = path_capacity
+        self.spill = TrajectorySpill(spill_path) if spill_path else None
+        # active vehicles, in the order they first appeared: ids, current boxes,
+        # paths and how many boxes of each path the overlay has
+        self.ids = np.empty(0, dtype=np.int64)
+        self.bboxes = np.empty((0, 4))
+        self.paths = []
+        self.drawn = np.empty(0, dtype=np.int64)
+        self.log = BoundaryLog()
+        # left path boundaries in blue, right ones in red over them
+        self.overlay = SegmentOverlay([(255, 0, 0), (0, 0, 255)])
+        # min_left, max_left, min_right, max_right over all frames, NaN until a vehicle is seen
+        self.extent = np.full(4, np.nan)
 
     def update(self, detections):
-        if detections:
-            detections = np.array(detections)
-            tracked_objects = self.tracker.update(detections)
-            current_ids = set()
-            for obj in tracked_objects:
-                obj_id = int(obj[4])
-                bbox = obj[:4]
-                current_ids.add(obj_id)
-                if obj_id in self.vehicle_dict:
-                    self.vehicle_dict[obj_id]['bbox'] = bbox
-                    self.vehicle_dict[obj_id]['path'].append(bbox)
-                else:
-                    self.vehicle_dict[obj_id] = {'id': obj_id, 'bbox': bbox, 'path': [bbox]}
-            obsolete_ids = set(self.vehicle_dict.keys()) - current_ids
-            for obj_id in obsolete_ids:
-                del self.vehicle_dict[obj_id]
+        if len(detections):
+            self.update_tracked(self.tracker.update(np.asarray(detections)))
+
+    def update_tracked(self, tracked_objects):
+        """
+        Takes the [x1,y1,x2,y2,id] rows a tracker reported for this frame.
+        """
+        tracked_objects = np.asarray(tracked_objects, dtype=float).reshape(-1, 5)
+        ids = tracked_objects[:, 4].astype(np.int64)
+        survivors = np.flatnonzero(np.isin(self.ids, ids))
+        new = np.flatnonzero(~np.isin(ids, self.ids))
+        self.ids = np.concatenate((self.ids[survivors], ids[new]))
+        sorter = np.argsort(ids)
+        self.bboxes = tracked_objects[sorter[np.searchsorted(ids, self.ids, sorter=sorter)], :4]
+        self.paths = [self.paths[i] for i in survivors] + [
+            TrajectoryBuffer(self.path_capacity, track_id=int(obj_id), spill=self.spill) for obj_id in ids[new]]
+        self.drawn = np.concatenate((self.drawn[survivors], np.zeros(len(new), dtype=np.int64)))
+        for path, bbox in zip(self.paths, self.bboxes):
+            path.append(bbox)
 
     def get_min_max_coordinates(self):
-        if not self.vehicle_dict:
-            return self.global_min_left, self.global_max_left, self.global_min_right, self.global_max_right
-
-        min_left = float('inf')
-        max_left = float('-inf')
-        min_right = float('inf')
-        max_right = float('-inf')
-
-        for vehicle in self.vehicle_dict.values():
-            x1, y1, x2, y2 = vehicle['bbox']
-            min_left = min(min_left, x1)
-            max_left = max(max_left, x2)
-            min_right = min(min_right, y1)
-            max_right = max(max_right, y2)
-
-        if self.global_min_left is None or min_left < self.global_min_left:
-            self.global_min_left = min_left
-        if self.global_max_left is None or max_left > self.global_max_left:
-            self.global_max_left = max_left
-        if self.global_min_right is None or min_right < self.global_min_right:
-            self.global_min_right = min_right
-        if self.global_max_right is None or max_right > self.global_max_right:
-            self.global_max_right = max_right
-
-        return self.global_min_left, self.global_max_left, self.global_min_right, self.global_max_right
+        """
+        Returns min_left, max_left, min_right, max_right over every vehicle
+        seen so far, NaN before the first one.
+        """
+        if len(self.ids):
+            self.extent[[0, 2]] = np.fmin(self.extent[[0, 2]], self.bboxes[:, [0, 1]].min(0))
+            self.extent[[1, 3]] = np.fmax(self.extent[[1, 3]], self.bboxes[:, [2, 3]].max(0))
+        return self.extent
 
     def record_boundaries(self, frame_id):
-        min_left, max_left, min_right, max_right = self.get_min_max_coordinates()
-        self.frame_boundaries.append([frame_id, min_left, max_left, min_right, max_right])
-        print(f"Frame {frame_id}: Min_Left = {min_left}, Max_Left = {max_left}, Min_Right = {min_right}, Max_Right = {max_right}")
+        extent = self.get_min_max_coordinates()
+        self.log.frames.append([frame_id, extent[0], extent[1], extent[2], extent[3]])
+
+    def stream_csv(self, path):
+        """
+        Streams the boundary rows to the CSV at `path` as the run goes; close()
+        finishes it.
+        """
+        self.log.stream(path)
 
     def draw(self, frame):
-        for vehicle in self.vehicle_dict.values():
-            x1, y1, x2, y2 = vehicle['bbox']
+        for i, (obj_id, bbox, path) in enumerate(zip(self.ids.tolist(), self.bboxes, self.paths)):
+            x1, y1, x2, y2 = bbox
             x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(frame, f"ID: {vehicle['id']}, Coordinates: ({x1},{y1}) - ({x2},{y2})",
+            cv2.putText(frame, f"ID: {obj_id}, Coordinates: ({x1},{y1}) - ({x2},{y2})",
                         (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            path = vehicle['path']
-            if len(path) > 1:
-                for i in range(1, len(path)):
-                    start_point1 = (int(path[i-1][0]), int((path[i-1][1] + path[i-1][3]) / 2))
-                    end_point1 = (int(path[i][0]), int((path[i][1] + path[i][3]) / 2))
-                    start_point2 = (int(path[i-1][2]), int((path[i-1][1] + path[i-1][3]) / 2))
-                    end_point2 = (int(path[i][2]), int((path[i][1] + path[i][3]) / 2))
-                    cv2.line(frame, start_point1, end_point1, (0, 0, 255), 2)
-                    cv2.line(frame, start_point2, end_point2, (0, 0, 255), 2)
-                    self.boundaries_left.append((start_point1, end_point1))
-                    self.boundaries_right.append((start_point2, end_point2))
+            # only the path segments added since the last frame are new to the overlay
+            new = min(path.total - max(self.drawn[i], 1), len(path) - 1)
+            self.drawn[i] = path.total
+            if new > 0:
+                boxes = path.array()[-(new + 1):]
+                middle = ((boxes[:, 1] + boxes[:, 3]) / 2).astype(int)
+                left, right = boxes[:, 0].astype(int), boxes[:, 2].astype(int)
+                self.overlay.add(0, np.column_stack((left[:-1], middle[:-1], left[1:], middle[1:])))
+                self.overlay.add(1, np.column_stack((right[:-1], middle[:-1], right[1:], middle[1:])))
 
     def detect_direction_and_draw_boundaries(self, frame):
-        for vehicle in self.vehicle_dict.values():
-            x1, y1, x2, y2 = vehicle['bbox']
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        corners = self.bboxes.astype(np.int64)
+        for x1, y1, x2, y2 in corners.tolist():
             cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
-            self.road_boundaries.append((vehicle['id'], x1, y1, x2, y2))
+        self.log.roads.extend(np.column_stack((self.ids, corners)))
 
     def draw_static_boundaries(self, frame):
-        for boundary in self.boundaries_left:
-            cv2.line(frame, boundary[0], boundary[1], (255, 0, 0), 2)
-        for boundary in self.boundaries_right:
-            cv2.line(frame, boundary[0], boundary[1], (0, 0, 255), 2)
-
-def find_vehicle_boundaries(video_path, max_frames=250):
+        self.overlay.composite(frame)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+        self.log.close()
+
+def find_vehicle_boundaries(video_path, max_frames=250, output_csv=None):
+    """
+    Tracks the video and returns the VehicleTracker's BoundaryLog, or None
+    when the video cannot be opened. With an output_csv the boundary rows are
+    streamed there during the run instead of being kept in memory.
+    """
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print("Error: Could not open video.")
-        return [], []
+        return None
 
-    bg_subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50)
+    detector = BlobDetector(cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50))
     tracker = VehicleTracker()
+    if output_csv:
+        tracker.stream_csv(output_csv)
     frame_count = 0
 
     while frame_count < max_frames:
@@ -115,55 +125,33 @@ def find_vehicle_boundaries(video_path, max_frames=250):
             break
 
         frame_count += 1
-        height, width = frame.shape[:2]
-        roi_frame = frame[int(height * 0.4):, :]
-
-        fg_mask = bg_subtractor.apply(roi_frame)
-        fg_mask = cv2.threshold(fg_mask, 230, 255, cv2.THRESH_BINARY)[1]
-        fg_mask = cv2.erode(fg_mask, None, iterations=3)
-        fg_mask = cv2.dilate(fg_mask, None, iterations=2)
-
-        contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        detections = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            x += 0
-            y += int(height * 0.4)
-            if w > 30 and h > 30:
-                detections.append([x, y, x + w, y + h, 1])
+        detections = detector.detect(frame)
 
         tracker.update(detections)
         tracker.record_boundaries(frame_count)
 
     cap.release()
-    return tracker.frame_boundaries, tracker.road_boundaries
+    tracker.close()
+    return tracker.log
 
 def save_boundaries_to_csv(boundaries, road_boundaries, output_csv):
     with open(output_csv, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        for boundary in boundaries:
-            writer.writerow(boundary)
-        
-        writer.writerow([])
-        writer.writerow(["Vehicle_ID", "Initial_BBox", "Current_BBox"])
-        for road_boundary in road_boundaries:
-            writer.writerow(road_boundary)
+        write_boundaries_csv(file, boundaries, road_boundaries)
 
 def mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames=250):
-    boundaries, road_boundaries = find_vehicle_boundaries(video_path, max_frames)
-    if not boundaries and not road_boundaries:
+    log = find_vehicle_boundaries(video_path, max_frames, output_csv)
+    if log is None or not len(log.frames) and not len(log.roads):
         print("Error: No boundaries found. Ensure the video path is correct.")
         return
 
-    save_boundaries_to_csv(boundaries, road_boundaries, output_csv)
-
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print("Error: Could not open video.")
         return
 
-    bg_subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50)
+    # the drawing pass smooths the foreground mask before thresholding it
+    detector = BlobDetector(cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50),
+                            threshold=190, erode=2, dilate=3, blur=5)
     tracker = VehicleTracker()
     frame_count = 0
 
@@ -176,24 +164,7 @@ def mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames=250)
             break
 
         frame_count += 1
-        height, width = frame.shape[:2]
-        roi_frame = frame[int(height * 0.4):, :]
-
-        fg_mask = bg_subtractor.apply(roi_frame)
-        fg_mask = cv2.GaussianBlur(fg_mask, (5, 5), 0)
-        fg_mask = cv2.threshold(fg_mask, 190, 255, cv2.THRESH_BINARY)[1]
-        fg_mask = cv2.erode(fg_mask, None, iterations=2)
-        fg_mask = cv2.dilate(fg_mask, None, iterations=3)
-
-        contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        detections = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            x += 0
-            y += int(height * 0.4)
-            if w > 30 and h > 30:
-                detections.append([x, y, x + w, y + h, 1])
+        detections = detector.detect(frame)
 
         tracker.update(detections)
         tracker.draw(frame)
@@ -204,6 +175,7 @@ def mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames=250)
 
     cap.release()
     out.release()
+    tracker.close()
 
     print("Final output video saved as:", output_path)
     print("CSV file with boundaries saved as:", output_csv)
@@ -1,35 +1,57 @@
 import cv2
 import numpy as np
-
-def extract_background(video_path, num_frames=250, components=5, var_threshold=120):
+from background_cache import BackgroundCache, video_fingerprint
+from pacing import HEADLESS, FramePacer
+
+def extract_background(video_path, num_frames=250, components=5, var_threshold=120, mode=HEADLESS,
+                       background_cache=None, refresh_frames=25):
+    """
+    Trains the GMM on num_frames frames. With a background_cache directory
+    holding a background learned for this video by an earlier run, the GMM
+    is seeded from it and trained on only refresh_frames frames, which also
+    refresh the cache.
+    """
     cap = cv2.VideoCapture(video_path)
 
     ret, frame = cap.read()
     height, width, _ = frame.shape
-    print(height, width)
+    if mode != HEADLESS:
+        print(height, width)
 
     gmm = cv2.createBackgroundSubtractorMOG2(history=num_frames, varThreshold=var_threshold, detectShadows=False)
 
+    cache = None
+    if background_cache:
+        cache = BackgroundCache(background_cache, video_fingerprint(video_path) + '-full', sample_every=5, save_every=0)
+        if cache.load() and cache.seed(gmm, frame.shape):
+            num_frames = refresh_frames
+
     for i in range(num_frames):
         ret, frame = cap.read()
         if not ret:
             break
         mask = gmm.apply(frame)
+        if cache is not None:
+            cache.observe(frame, gmm)
     cap.release()
+    if cache is not None:
+        cache.save(gmm)
 
     return gmm, height, width
 
-def extract_road_region(video_path):
-    trained_gmm, height, width = extract_background(video_path)
+def extract_road_region(video_path, mode=HEADLESS, background_cache=None):
+    trained_gmm, height, width = extract_background(video_path, mode=mode, background_cache=background_cache)
     total_foreground = np.zeros((height, width), dtype=np.uint8)
     frame_count = 0
     cap2 = cv2.VideoCapture(video_path)
+    pacer = FramePacer(mode, cap2.get(cv2.CAP_PROP_FPS), window='foreground.png')
     prev_frame = None
 
     while True:
         # print(frame_count)
         if frame_count > 400:
-            print("Road Mask Formed...")
+            if not pacer.headless:
+                print("Road Mask Formed...")
             break
 
         ret2, img = cap2.read()
@@ -63,12 +85,11 @@ def extract_road_region(video_path):
         background = cv2.bitwise_and(img, img, mask=cv2.bitwise_not(foreground_mask))
 
         # cv2.imshow("MainImage", img_blurred)
-        # cv2.imshow('foreground.png', total_foreground)
-        if cv2.waitKey(10) & 0xFF == ord('q'):
+        if not pacer.wait(total_foreground):
             break
 
     cap2.release()
-    cv2.destroyAllWindows()
+    pacer.close()
 
     return total_foreground
 
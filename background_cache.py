@@ -0,0 +1,118 @@
+"""
+On-disk warm start for the MOG2 background models of fixed cameras.
+
+OpenCV does not expose the mixture a BackgroundSubtractorMOG2 has learned,
+so the cache keeps what can be read back from it: the background image, plus
+a per-pixel noise variance estimated from the frames a run sees. A new
+subtractor is seeded by feeding it frames drawn from that background and
+noise, so it starts out converged instead of flagging the whole scene as
+foreground until it has seen a few hundred frames. Runs keep refreshing the
+cache as they go.
+"""
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from checkpoint import load_checkpoint, save_checkpoint
+
+
+def video_fingerprint(video_path):
+    """
+    Identifies a recording by its resolution, frame count and a thumbnail of
+    its first frame. Pass a camera name as the cache key instead to share one
+    cache between recordings of the same camera.
+    """
+    cap = cv2.VideoCapture(video_path)
+    ret, frame = cap.read()
+    size = [cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT), cap.get(cv2.CAP_PROP_FRAME_COUNT)]
+    cap.release()
+    digest = hashlib.sha1(np.array(size, dtype=np.int64).tobytes())
+    if ret:
+        digest.update(cv2.resize(frame, (32, 18), interpolation=cv2.INTER_AREA).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class BackgroundCache(object):
+    """
+    The cached background of one camera, stored as <cache_dir>/<key>.npz.
+
+    seed() warms up a fresh subtractor with seed_frames synthetic frames,
+    cycling through a few noise fields since drawing noise for a full frame
+    costs about as much as the subtractor update itself.
+    observe() is called with every frame the subtractor is applied to: every
+    sample_every frames it folds the frame's difference from the current
+    background into the noise variance, ignoring pixels that differ by more
+    than moving_level (vehicles), and every save_every frames it writes the
+    cache.
+    """
+
+    def __init__(self, cache_dir, key, seed_frames=30, sample_every=25, save_every=1000, moving_level=30.0):
+        self.path = os.path.join(cache_dir, key + '.npz')
+        self.seed_frames = seed_frames
+        self.sample_every = sample_every
+        self.save_every = save_every
+        self.moving_level = moving_level
+        self.background = None
+        self.variance = None
+        self.frames = 0
+
+    def load(self):
+        """
+        Reads the cache; returns False when there is none yet.
+        """
+        state = load_checkpoint(self.path, 'background_model')
+        if state is None:
+            return False
+        self.background = state['background']
+        self.variance = state['variance']
+        self.frames = int(state['frames'])
+        return True
+
+    def seed(self, bg_subtractor, shape, seed=0):
+        """
+        Trains bg_subtractor, for frames of `shape`, on the cached background.
+        Returns False, leaving it untouched, when there is no cache for such
+        frames.
+        """
+        if self.background is None or self.background.shape != tuple(shape):
+            return False
+        rng = np.random.default_rng(seed)
+        std = np.sqrt(self.variance)[..., None]
+        frames = [np.clip(self.background + rng.standard_normal(self.background.shape, dtype=np.float32) * std,
+                          0, 255).astype(np.uint8) for _ in range(min(5, self.seed_frames))]
+        for i in range(self.seed_frames):
+            bg_subtractor.apply(frames[i % len(frames)])
+        return True
+
+    def observe(self, frame, bg_subtractor):
+        self.frames += 1
+        if self.frames % self.sample_every == 0:
+            background = bg_subtractor.getBackgroundImage()
+            if background is not None and background.shape == frame.shape:
+                difference = cv2.absdiff(frame, background).astype(np.float32)
+                squared = (difference * difference).mean(axis=2)
+                if self.variance is None or self.variance.shape != squared.shape:
+                    self.variance = np.full(squared.shape, 4.0, dtype=np.float32)
+                quiet = squared < self.moving_level ** 2
+                self.variance[quiet] += 0.1 * (squared[quiet] - self.variance[quiet])
+                self.background = background
+        if self.save_every and self.frames % self.save_every == 0:
+            self.save(bg_subtractor)
+
+    def save(self, bg_subtractor):
+        """
+        Writes the subtractor's current background to the cache.
+        """
+        background = bg_subtractor.getBackgroundImage()
+        if background is None or background.ndim != 3:
+            return
+        self.background = background
+        if self.variance is None or self.variance.shape != background.shape[:2]:
+            self.variance = np.full(background.shape[:2], 4.0, dtype=np.float32)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        save_checkpoint(self.path, 'background_model', {'background': self.background, 'variance': self.variance,
+                                                        'frames': np.array(self.frames)})
@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the SORT association step.
+
+For every size N a synthetic frame of N detections is matched against N
+tracks predicted from the previous frame, with a share of the objects
+missing on each side. The per-frame cost of associate_detections_to_trackers
+is reported together with its IoU matrix and assignment solver parts;
+whatever is left over is the bookkeeping that turns the assignment into
+matches and unmatched sets. Above --max_dense_pairs the step runs gated, so
+the IoU and solver columns then show what the dense path would have cost.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from sort import DENSE_MAX_PAIRS, associate_detections_to_trackers, iou_batch, linear_assignment
+
+SIZES = [10, 30, 100, 300, 1000]
+
+
+def synthetic_frame(size, rng, extent=4000.0, miss=0.1):
+    """
+    Returns (detections, tracks) for `size` objects scattered over an
+    extent x extent scene, the tracks jittered a few pixels off the
+    detections and `miss` of the objects dropped from each side.
+    """
+    corners = rng.uniform(0, extent, (size, 2))
+    boxes = np.hstack([corners, corners + rng.uniform(20, 80, (size, 2))])
+    tracks = boxes + rng.normal(0, 3, boxes.shape)
+    detections = np.hstack([boxes, rng.random((size, 1))])
+    detections = detections[rng.random(size) > miss]
+    tracks = np.hstack([tracks, np.zeros((size, 1))])[rng.random(size) > miss]
+    return detections[rng.permutation(len(detections))], tracks
+
+
+def time_call(function, repeats, *args):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(*args)
+    return (time.perf_counter() - start) / repeats
+
+
+def measure(size, repeats, iou_threshold, max_dense_pairs, rng):
+    # the scene grows with the object count so the density stays that of 1000 objects over 4000 x 4000
+    detections, tracks = synthetic_frame(size, rng, extent=4000.0 * np.sqrt(size / 1000.0))
+    iou_matrix = iou_batch(detections, tracks)
+    total = time_call(associate_detections_to_trackers, repeats, detections, tracks, iou_threshold, max_dense_pairs)
+    iou = time_call(iou_batch, repeats, detections, tracks)
+    # the solver only runs when the IoU matrix is not already one-to-one
+    overlaps = iou_matrix > iou_threshold
+    one_to_one = overlaps.sum(1).max() == 1 and overlaps.sum(0).max() == 1
+    assignment = 0.0 if one_to_one else time_call(linear_assignment, repeats, -iou_matrix)
+    return {'size': size, 'detections': len(detections), 'tracks': len(tracks),
+            'total_ms': total * 1000, 'iou_ms': iou * 1000, 'assignment_ms': assignment * 1000,
+            'bookkeeping_ms': max(total - iou - assignment, 0.0) * 1000}
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='SORT association micro-benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Detections and tracks per frame.')
+    parser.add_argument('--repeats', type=int, default=20, help='Timed calls per size [20].')
+    parser.add_argument('--iou_threshold', type=float, default=0.3, help='Minimum IOU for match.')
+    parser.add_argument('--max_dense_pairs', type=int, default=DENSE_MAX_PAIRS,
+                        help='Pair count above which association is gated [%d].' % DENSE_MAX_PAIRS)
+    parser.add_argument('--output', default=None, help='Optional JSON report path.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    results = []
+    print("%6s %6s %6s %10s %10s %10s %12s" % ('size', 'dets', 'trks', 'total ms', 'iou ms', 'assign ms',
+                                               'bookkeep ms'))
+    for size in args.sizes:
+        result = measure(size, args.repeats, args.iou_threshold, args.max_dense_pairs, rng)
+        results.append(result)
+        print("%6d %6d %6d %10.3f %10.3f %10.3f %12.3f" % (
+            size, result['detections'], result['tracks'], result['total_ms'], result['iou_ms'],
+            result['assignment_ms'], result['bookkeeping_ms']))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'repeats': args.repeats, 'max_dense_pairs': args.max_dense_pairs, 'results': results}, fp, indent=2)
+        print("Report written to", args.output)
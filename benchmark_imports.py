@@ -0,0 +1,71 @@
+"""
+Import-time budget for the modules worker processes load.
+
+Every module is imported in a fresh interpreter, several times, and the
+fastest import is compared against the budget. The run also fails when an
+import drags in one of the display or export libraries, which must only be
+loaded by the demo and export paths that use them. Exits non-zero when any
+module is over budget, so it can gate a CI job.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# modules imported by worker processes and headless jobs
+WORKER_MODULES = ['sort', 'tracker_manager', 'offline_sort', 'mot_eval', 'trajectory', 'checkpoint',
+                  'lattice', 'lattice_runner', 'lattice_analyzer', 'occupancy_log', 'occupancy_stats']
+HEAVY_MODULES = ['matplotlib', 'skimage', 'filterpy', 'scipy', 'pandas', 'openpyxl', 'tkinter', 'PIL']
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(name for name in {heavy!r} if name in sys.modules))
+'''
+
+
+def time_import(module, repeats):
+    best = None
+    heavy = []
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                         cwd=HERE).decode().split()
+        elapsed = float(output[0])
+        heavy = output[1].split(',') if len(output) > 1 else []
+        best = elapsed if best is None else min(best, elapsed)
+    return best, heavy
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Import-time budget for worker modules')
+    parser.add_argument('--modules', nargs='+', default=WORKER_MODULES, help='Modules to import.')
+    parser.add_argument('--budget_ms', type=float, default=400.0, help='Budget per module import [400].')
+    parser.add_argument('--repeats', type=int, default=3, help='Imports per module; the fastest counts [3].')
+    parser.add_argument('--output', default=None, help='Optional JSON report path.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = []
+    failed = False
+    for module in args.modules:
+        elapsed, heavy = time_import(module, args.repeats)
+        over = elapsed * 1000 > args.budget_ms
+        failed = failed or over or bool(heavy)
+        results.append({'module': module, 'import_ms': elapsed * 1000, 'heavy_modules': heavy})
+        print("%-18s %8.1f ms  %s%s" % (module, elapsed * 1000, 'OVER BUDGET ' if over else '',
+                                        'loads ' + ', '.join(heavy) if heavy else ''))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'budget_ms': args.budget_ms, 'results': results}, fp, indent=2)
+    if failed:
+        print("Startup budget of %.0f ms per module exceeded or heavy modules loaded" % args.budget_ms)
+        sys.exit(1)
@@ -0,0 +1,188 @@
+"""
+Reproducible benchmark of the lattice variants.
+
+Every (variant, video) case runs in a fresh spawned process so peak RSS and
+CPU time are its own. A case makes two passes over the same frames:
+
+  * an end-to-end headless process_video() run, giving fps, CPU time and
+    CPU utilisation (CPU seconds per wall second, pool workers included);
+  * an instrumented single-threaded pass that times each stage per frame:
+    diff, colour conversion, cell analysis, log write and encode.
+
+Results go to a JSON report together with the library versions, the
+machine and the git revision, so runs can be compared across versions.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import psutil
+
+import HSVpart4
+import parallel
+import parallel2
+from lattice_analyzer import LatticeOccupancyAnalyzer
+from occupancy_log import OccupancyLog
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VIDEOS = [os.path.join(HERE, 'footage_4.mp4'), os.path.join(HERE, 'multilane_hsv_normal_doc.mp4')]
+STAGES = ['diff', 'colour', 'cells', 'log', 'encode']
+
+
+def script_rois(script):
+    return [(script.roi1_x, script.roi1_y, script.roi1_width, script.roi1_height),
+            (script.roi2_x, script.roi2_y, script.roi2_width, script.roi2_height)]
+
+
+# each variant runs the configuration its script currently ships with
+VARIANTS = {
+    'sequential': dict(rois=script_rois(HSVpart4), channels=HSVpart4.user_choice, vote='all', parallel=False),
+    'parallel': dict(rois=script_rois(parallel), channels=parallel.channels, vote=parallel.vote, parallel=True),
+    'parallel_and': dict(rois=script_rois(parallel2), channels=parallel2.channels, vote=parallel2.vote,
+                         parallel=True),
+}
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    if not len(samples):
+        return {}
+    return {'mean_ms': float(samples.mean()), 'p50_ms': float(np.percentile(samples, 50)),
+            'p90_ms': float(np.percentile(samples, 90)), 'p99_ms': float(np.percentile(samples, 99)),
+            'max_ms': float(samples.max())}
+
+
+def time_stages(analyzer, video_path, max_frames, workdir):
+    timings = {stage: [] for stage in STAGES}
+    cap = cv2.VideoCapture(video_path)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(os.path.join(workdir, 'stages.mp4'), fourcc, 20.0, (int(cap.get(3)), int(cap.get(4))))
+    log = OccupancyLog(os.path.join(workdir, 'stages.npy'), analyzer.num_rows, analyzer.num_cols,
+                       num_rois=len(analyzer.shapes))
+    preprocessor = analyzer.preprocessor
+    clock = time.perf_counter
+
+    ret, frame1 = cap.read()
+    ret, frame2 = cap.read()
+    frames = 0
+    while ret and frames < max_frames:
+        start = clock()
+        preprocessor.difference(frame1, frame2)
+        diffed = clock()
+        planes = preprocessor.convert()
+        converted = clock()
+        matrices = analyzer.process_planes(planes, preprocessor.rois)
+        analysed = clock()
+        log.append(*matrices)
+        logged = clock()
+        analyzer.draw(frame1, matrices)
+        out.write(frame1)
+        cv2.imencode('.jpg', frame1)
+        encoded = clock()
+
+        for stage, begin, end in zip(STAGES, (start, diffed, converted, analysed, logged),
+                                     (diffed, converted, analysed, logged, encoded)):
+            timings[stage].append(end - begin)
+        frames += 1
+        frame1 = frame2
+        ret, frame2 = cap.read()
+
+    log.close()
+    out.release()
+    cap.release()
+    return {stage: percentiles(samples) for stage, samples in timings.items()}
+
+
+def run_case(variant, video_path, max_frames, workers, queue):
+    try:
+        queue.put(measure_case(variant, video_path, max_frames, workers))
+    except Exception as e:
+        queue.put({'variant': variant, 'video': os.path.basename(video_path), 'error': repr(e)})
+        raise
+
+
+def measure_case(variant, video_path, max_frames, workers):
+    config = dict(VARIANTS[variant])
+    use_pool = config.pop('parallel')
+    analyzer = LatticeOccupancyAnalyzer(**config)
+    process = psutil.Process()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cpu_before, children_before = process.cpu_times(), os.times()
+        wall_before = time.perf_counter()
+        summary = analyzer.process_video(video_path, output_path=os.path.join(workdir, 'out.mp4'),
+                                         frames_dir=os.path.join(workdir, 'frames'),
+                                         log_path=os.path.join(workdir, 'log.npy'),
+                                         max_frames=max_frames, workers=workers if use_pool else None)
+        wall = time.perf_counter() - wall_before
+        cpu_after, children_after = process.cpu_times(), os.times()
+        # pool workers from the joined pool; psutil leaves its children fields at 0 on macOS and Windows
+        cpu = (cpu_after.user + cpu_after.system - cpu_before.user - cpu_before.system +
+               children_after.children_user + children_after.children_system -
+               children_before.children_user - children_before.children_system)
+
+        stages = time_stages(analyzer, video_path, max_frames, workdir)
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+    return {'variant': variant, 'video': os.path.basename(video_path), 'frames': summary['frames'],
+            'workers': workers if use_pool else 1, 'fps': summary['fps'], 'wall_s': wall,
+            'cpu_s': cpu, 'cpu_utilisation': cpu / wall if wall > 0 else 0.0,
+            'peak_rss_mb': peak_rss / (1024 * 1024), 'writer_stall_s': summary['writer']['stall_time'],
+            'stages': stages}
+
+
+def environment():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                           cwd=HERE).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'git_revision': revision, 'python': platform.python_version(), 'numpy': np.__version__,
+            'opencv': cv2.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'opencv_threads': cv2.getNumThreads()}
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Lattice variant benchmark')
+    parser.add_argument('--videos', nargs='+', default=VIDEOS, help='Videos to run every variant on.')
+    parser.add_argument('--variants', nargs='+', choices=sorted(VARIANTS), default=sorted(VARIANTS))
+    parser.add_argument('--max_frames', type=int, default=300, help='Frame pairs per video [300].')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Pool size of the parallel variants.')
+    parser.add_argument('--output', default='benchmark_report.json', help='Report path [benchmark_report.json].')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    context = mp.get_context('spawn')
+    results = []
+    for video_path in args.videos:
+        for variant in args.variants:
+            queue = context.Queue()
+            worker = context.Process(target=run_case, args=(variant, video_path, args.max_frames, args.workers, queue))
+            worker.start()
+            result = queue.get()
+            worker.join()
+            results.append(result)
+            if 'error' in result:
+                print("%-13s %-30s failed: %s" % (variant, result['video'], result['error']))
+                continue
+            print("%-13s %-30s %7.1f fps  cpu %4.2f  peak %6.1f MB  cells p50 %.2f ms" % (
+                variant, result['video'], result['fps'], result['cpu_utilisation'], result['peak_rss_mb'],
+                result['stages']['cells'].get('p50_ms', 0.0)))
+
+    with open(args.output, 'w') as fp:
+        json.dump({'environment': environment(), 'max_frames': args.max_frames, 'results': results}, fp, indent=2)
+    print("Report written to", args.output)
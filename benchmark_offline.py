@@ -0,0 +1,65 @@
+"""
+Wall time of offline tracking against the plain online loop.
+
+The same synthetic scene is tracked by `for dets in frames:
+tracker.update(dets)`, by track_offline without smoothing and by
+track_offline with the RTS smoother. The variants run interleaved, and
+the best of --repeats runs is reported, so one slow run does not skew the
+comparison.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmark_sort import moving_scene
+from offline_sort import track_offline
+from sort import Sort
+
+SIZES = [10, 200]
+
+
+def plain_loop(frames, max_age, min_hits):
+    tracker = Sort(max_age=max_age, min_hits=min_hits)
+    for dets in frames:
+        tracker.update(dets)
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Offline tracking against a plain Sort.update loop')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Objects in the scene.')
+    parser.add_argument('--frames', type=int, default=300, help='Frames per scene [300].')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per variant, best one reported [5].')
+    parser.add_argument('--max_age', type=int, default=3, help='Sort max_age [3].')
+    parser.add_argument('--min_hits', type=int, default=3, help='Sort min_hits [3].')
+    parser.add_argument('--output', default=None, help='Optional JSON report path.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    results = []
+    print("%6s %10s %12s %12s" % ('size', 'loop s', 'offline s', 'smoothed s'))
+    for size in args.sizes:
+        frames = moving_scene(size, args.frames, rng)
+        rows = np.concatenate([np.hstack((np.full((len(dets), 1), frame + 1.), dets))
+                               for frame, dets in enumerate(frames)])
+        variants = {'loop': lambda: plain_loop(frames, args.max_age, args.min_hits),
+                    'offline': lambda: track_offline(rows, args.max_age, args.min_hits, smooth=False),
+                    'smoothed': lambda: track_offline(rows, args.max_age, args.min_hits)}
+        best = dict.fromkeys(variants, np.inf)
+        for _ in range(args.repeats):
+            for name, run in variants.items():
+                start = time.perf_counter()
+                run()
+                best[name] = min(best[name], time.perf_counter() - start)
+        results.append(dict(best, size=size))
+        print("%6d %10.3f %12.3f %12.3f" % (size, best['loop'], best['offline'], best['smoothed']))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'frames': args.frames, 'results': results}, fp, indent=2)
+        print("Report written to", args.output)
@@ -0,0 +1,87 @@
+"""
+Per-frame latency and allocation profile of Sort.update.
+
+A synthetic scene of moving boxes is tracked twice per size: once timing
+every update() and once under tracemalloc, recording how many bytes each
+update() allocates at its peak above what is still live afterwards. Tail
+latency (p99, max) is what allocator and GC pauses show up in.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from sort import Sort
+
+SIZES = [10, 100, 500]
+
+
+def moving_scene(size, frames, rng, extent=2000.0, miss=0.1):
+    """
+    Returns `frames` detection arrays of `size` boxes drifting at constant
+    velocity with pixel noise, `miss` of them dropped on each frame.
+    """
+    corners = rng.uniform(0, extent, (size, 2))
+    velocity = rng.normal(0, 2, (size, 2))
+    extents = rng.uniform(20, 80, (size, 2))
+    scene = []
+    for _ in range(frames):
+        corners += velocity
+        boxes = np.hstack([corners, corners + extents]) + rng.normal(0, 1, (size, 4))
+        dets = np.hstack([boxes, np.ones((size, 1))])
+        scene.append(dets[rng.random(size) > miss])
+    return scene
+
+
+def profile(scene, reuse_output):
+    tracker = Sort(max_age=3, reuse_output=reuse_output)
+    latencies = []
+    for dets in scene:
+        start = time.perf_counter()
+        tracker.update(dets)
+        latencies.append(time.perf_counter() - start)
+
+    tracker = Sort(max_age=3, reuse_output=reuse_output)
+    transient = []
+    tracemalloc.start()
+    for dets in scene:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        tracker.update(dets)
+        current, peak = tracemalloc.get_traced_memory()
+        transient.append(peak - max(current, before))
+    tracemalloc.stop()
+
+    latencies = np.array(latencies[len(latencies) // 10:]) * 1000
+    return {'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99)),
+            'max_ms': float(latencies.max()), 'transient_kb': float(np.mean(transient)) / 1024}
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Sort.update latency and allocation profile')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Objects in the scene.')
+    parser.add_argument('--frames', type=int, default=300, help='Frames per scene [300].')
+    parser.add_argument('--output', default=None, help='Optional JSON report path.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    results = []
+    print("%6s %8s %9s %9s %9s %13s" % ('size', 'reuse', 'p50 ms', 'p99 ms', 'max ms', 'transient KB'))
+    for size in args.sizes:
+        scene = moving_scene(size, args.frames, rng)
+        for reuse_output in (False, True):
+            result = dict(profile(scene, reuse_output), size=size, reuse_output=reuse_output)
+            results.append(result)
+            print("%6d %8s %9.3f %9.3f %9.3f %13.1f" % (size, reuse_output, result['p50_ms'], result['p99_ms'],
+                                                        result['max_ms'], result['transient_kb']))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'frames': args.frames, 'results': results}, fp, indent=2)
+        print("Report written to", args.output)
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+
+
+class BlobDetector(object):
+    """
+    Moving blobs of one camera as the [x1,y1,x2,y2,score] rows Sort.update
+    takes. The foreground of the lower part of the frame (below roi_top of
+    its height) is thresholded, eroded and dilated, optionally after a
+    blur, and every blob larger than min_size in both directions becomes a
+    row. The outer contours of all blobs come from one cv2.findContours call
+    and their boxes are computed, filtered and offset as arrays.
+    """
+
+    def __init__(self, bg_subtractor, roi_top=0.4, threshold=230, erode=3, dilate=2, blur=None, min_size=30):
+        self.bg_subtractor = bg_subtractor
+        self.roi_top = roi_top
+        self.threshold = threshold
+        self.erode = erode
+        self.dilate = dilate
+        self.blur = (blur, blur) if blur else None
+        self.min_size = min_size
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        self.height = None
+        self.offset = None
+
+    def roi_shape(self, frame_shape):
+        """
+        Returns the shape of the part of frames of frame_shape detections are made in.
+        """
+        height = frame_shape[0]
+        return (height - int(height * self.roi_top),) + tuple(frame_shape[1:])
+
+    def crop(self, frame):
+        """
+        Returns the part of the frame detections are made in.
+        """
+        if frame.shape[0] != self.height:
+            self.height = frame.shape[0]
+            self.offset = int(self.height * self.roi_top)
+        return frame[self.offset:, :]
+
+    def apply(self, frame):
+        """
+        Only updates the background model with the frame.
+        """
+        self.bg_subtractor.apply(self.crop(frame))
+
+    def detect(self, frame):
+        """
+        Updates the background model and returns the frame's blobs as a (N,5) array.
+        """
+        fg_mask = self.bg_subtractor.apply(self.crop(frame))
+        if self.blur:
+            fg_mask = cv2.GaussianBlur(fg_mask, self.blur, 0)
+        fg_mask = cv2.threshold(fg_mask, self.threshold, 255, cv2.THRESH_BINARY)[1]
+        fg_mask = cv2.erode(fg_mask, self.kernel, iterations=self.erode)
+        fg_mask = cv2.dilate(fg_mask, self.kernel, iterations=self.dilate)
+
+        contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return np.empty((0, 5))
+        # bounding boxes of all outer contours at once from their concatenated points
+        points = np.concatenate(contours)[:, 0]
+        starts = np.cumsum([0] + [len(contour) for contour in contours[:-1]])
+        low = np.minimum.reduceat(points, starts)
+        size = np.maximum.reduceat(points, starts) - low + 1
+        blobs = np.flatnonzero((size > self.min_size).all(1))
+        x, y = low[blobs, 0], low[blobs, 1]
+        w, h = size[blobs, 0], size[blobs, 1]
+
+        detections = np.ones((len(blobs), 5))
+        detections[:, 0] = x
+        detections[:, 1] = y + self.offset
+        detections[:, 2] = x + w
+        detections[:, 3] = y + self.offset + h
+        return detections
@@ -1,169 +1,349 @@
+import os
 import cv2
 import numpy as np
 from sort import Sort  # Make sure the SORT library is available
-import csv
+from background_cache import BackgroundCache, video_fingerprint
+from blob_detector import BlobDetector
+from checkpoint import load_checkpoint, prefixed, save_checkpoint, unprefixed
+from offline_sort import track_offline
+from overlay import SegmentOverlay
+from track_store import BoundaryLog, write_boundaries_csv
+from trajectory import TrajectoryBuffer, TrajectorySpill
 import sys
 
 class VehicleTracker:
-    def __init__(self):
+    def __init__(self, path_capacity=256, spill_path=None):
+        """
+        Each vehicle keeps its last path_capacity boxes; with a spill_path every
+        box is also appended to that file (see trajectory.load_spill).
+        Boundaries are logged in a track_store.BoundaryLog, see stream_csv().
+        """
         self.tracker = Sort()
-        self.vehicle_dict = {}
-        self.frame_boundaries = []
-        self.road_boundaries = []
-        self.boundaries_left = []
-        self.boundaries_right = []
-        self.global_min_left = None
-        self.global_max_left = None
-        self.global_min_right = None
-        self.global_max_right = None
+        self.path_capacity = path_capacity
+        self.spill = TrajectorySpill(spill_path) if spill_path else None
+        # active vehicles, in the order they first appeared: ids, current boxes,
+        # paths and how many boxes of each path the overlay has
+        self.ids = np.empty(0, dtype=np.int64)
+        self.bboxes = np.empty((0, 4))
+        self.paths = []
+        self.drawn = np.empty(0, dtype=np.int64)
+        self.log = BoundaryLog()
+        # left path boundaries in blue, right ones in red over them
+        self.overlay = SegmentOverlay([(255, 0, 0), (0, 0, 255)])
+        # min_left, max_left, min_right, max_right over all frames, NaN until a vehicle is seen
+        self.extent = np.full(4, np.nan)
 
     def update(self, detections):
-        if detections:
-            detections = np.array(detections)
-            tracked_objects = self.tracker.update(detections)
-            current_ids = set()
-            for obj in tracked_objects:
-                obj_id = int(obj[4])
-                bbox = obj[:4]
-                current_ids.add(obj_id)
-                if obj_id in self.vehicle_dict:
-                    self.vehicle_dict[obj_id]['bbox'] = bbox
-                    self.vehicle_dict[obj_id]['path'].append(bbox)
-                else:
-                    self.vehicle_dict[obj_id] = {'id': obj_id, 'bbox': bbox, 'path': [bbox]}
-            obsolete_ids = set(self.vehicle_dict.keys()) - current_ids
-            for obj_id in obsolete_ids:
-                del self.vehicle_dict[obj_id]
+        if len(detections):
+            self.update_tracked(self.tracker.update(np.asarray(detections)))
+
+    def update_tracked(self, tracked_objects):
+        """
+        Takes the [x1,y1,x2,y2,id] rows a tracker reported for this frame.
+        """
+        tracked_objects = np.asarray(tracked_objects, dtype=float).reshape(-1, 5)
+        ids = tracked_objects[:, 4].astype(np.int64)
+        survivors = np.flatnonzero(np.isin(self.ids, ids))
+        new = np.flatnonzero(~np.isin(ids, self.ids))
+        self.ids = np.concatenate((self.ids[survivors], ids[new]))
+        sorter = np.argsort(ids)
+        self.bboxes = tracked_objects[sorter[np.searchsorted(ids, self.ids, sorter=sorter)], :4]
+        self.paths = [self.paths[i] for i in survivors] + [
+            TrajectoryBuffer(self.path_capacity, track_id=int(obj_id), spill=self.spill) for obj_id in ids[new]]
+        self.drawn = np.concatenate((self.drawn[survivors], np.zeros(len(new), dtype=np.int64)))
+        for path, bbox in zip(self.paths, self.bboxes):
+            path.append(bbox)
 
     def get_min_max_coordinates(self):
-        if not self.vehicle_dict:
-            return self.global_min_left, self.global_max_left, self.global_min_right, self.global_max_right
-
-        min_left = float('inf')
-        max_left = float('-inf')
-        min_right = float('inf')
-        max_right = float('-inf')
-
-        for vehicle in self.vehicle_dict.values():
-            x1, y1, x2, y2 = vehicle['bbox']
-            min_left = min(min_left, x1)
-            max_left = max(max_left, x2)
-            min_right = min(min_right, y1)
-            max_right = max(max_right, y2)
-
-        if self.global_min_left is None or min_left < self.global_min_left:
-            self.global_min_left = min_left
-        if self.global_max_left is None or max_left > self.global_max_left:
-            self.global_max_left = max_left
-        if self.global_min_right is None or min_right < self.global_min_right:
-            self.global_min_right = min_right
-        if self.global_max_right is None or max_right > self.global_max_right:
-            self.global_max_right = max_right
-
-        return self.global_min_left, self.global_max_left, self.global_min_right, self.global_max_right
+        """
+        Returns min_left, max_left, min_right, max_right over every vehicle
+        seen so far, NaN before the first one.
+        """
+        if len(self.ids):
+            self.extent[[0, 2]] = np.fmin(self.extent[[0, 2]], self.bboxes[:, [0, 1]].min(0))
+            self.extent[[1, 3]] = np.fmax(self.extent[[1, 3]], self.bboxes[:, [2, 3]].max(0))
+        return self.extent
 
     def record_boundaries(self, frame_id):
-        min_left, max_left, min_right, max_right = self.get_min_max_coordinates()
-        self.frame_boundaries.append([frame_id, min_left, max_left, min_right, max_right])
-        print(f"Frame {frame_id}: Min_Left = {min_left}, Max_Left = {max_left}, Min_Right = {min_right}, Max_Right = {max_right}")
+        extent = self.get_min_max_coordinates()
+        self.log.frames.append([frame_id, extent[0], extent[1], extent[2], extent[3]])
+
+    def stream_csv(self, path):
+        """
+        Streams the boundary rows to the CSV at `path` as the run goes; close()
+        finishes it.
+        """
+        self.log.stream(path)
 
     def draw(self, frame):
-        for vehicle in self.vehicle_dict.values():
-            x1, y1, x2, y2 = vehicle['bbox']
+        for i, (obj_id, bbox, path) in enumerate(zip(self.ids.tolist(), self.bboxes, self.paths)):
+            x1, y1, x2, y2 = bbox
             x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(frame, f"ID: {vehicle['id']}, Coordinates: ({x1},{y1}) - ({x2},{y2})",
+            cv2.putText(frame, f"ID: {obj_id}, Coordinates: ({x1},{y1}) - ({x2},{y2})",
                         (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            path = vehicle['path']
-            if len(path) > 1:
-                for i in range(1, len(path)):
-                    start_point1 = (int(path[i-1][0]), int((path[i-1][1] + path[i-1][3]) / 2))
-                    end_point1 = (int(path[i][0]), int((path[i][1] + path[i][3]) / 2))
-                    start_point2 = (int(path[i-1][2]), int((path[i-1][1] + path[i-1][3]) / 2))
-                    end_point2 = (int(path[i][2]), int((path[i][1] + path[i][3]) / 2))
-                    cv2.line(frame, start_point1, end_point1, (0, 0, 255), 2)
-                    cv2.line(frame, start_point2, end_point2, (0, 0, 255), 2)
-                    self.boundaries_left.append((start_point1, end_point1))
-                    self.boundaries_right.append((start_point2, end_point2))
+            # only the path segments added since the last frame are new to the overlay
+            new = min(path.total - max(self.drawn[i], 1), len(path) - 1)
+            self.drawn[i] = path.total
+            if new > 0:
+                boxes = path.array()[-(new + 1):]
+                middle = ((boxes[:, 1] + boxes[:, 3]) / 2).astype(int)
+                left, right = boxes[:, 0].astype(int), boxes[:, 2].astype(int)
+                self.overlay.add(0, np.column_stack((left[:-1], middle[:-1], left[1:], middle[1:])))
+                self.overlay.add(1, np.column_stack((right[:-1], middle[:-1], right[1:], middle[1:])))
 
     def detect_direction_and_draw_boundaries(self, frame):
-        for vehicle in self.vehicle_dict.values():
-            x1, y1, x2, y2 = vehicle['bbox']
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        corners = self.bboxes.astype(np.int64)
+        for x1, y1, x2, y2 in corners.tolist():
             cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
-            self.road_boundaries.append((vehicle['id'], x1, y1, x2, y2))
+        self.log.roads.extend(np.column_stack((self.ids, corners)))
 
     def draw_static_boundaries(self, frame):
-        for boundary in self.boundaries_left:
-            cv2.line(frame, boundary[0], boundary[1], (255, 0, 0), 2)
-        for boundary in self.boundaries_right:
-            cv2.line(frame, boundary[0], boundary[1], (0, 0, 255), 2)
-
-def find_vehicle_boundaries(video_path, max_frames=250):
+        self.overlay.composite(frame)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+        self.log.close()
+
+    def snapshot(self):
+        """
+        Returns the full tracking state as a flat dict of arrays for save_checkpoint().
+        """
+        state = prefixed('sort', self.tracker.snapshot())
+        state.update(
+            vehicle_ids=self.ids.copy(),
+            vehicle_bboxes=self.bboxes.copy(),
+            path_lengths=np.array([len(path) for path in self.paths], dtype=np.int64),
+            path_totals=np.array([path.total for path in self.paths], dtype=np.int64),
+            paths=np.concatenate([path.array() for path in self.paths] + [np.empty((0, 4))]),
+            global_extent=self.extent.copy())
+        state.update(prefixed('log', self.log.snapshot()))
+        state.update(prefixed('overlay', self.overlay.snapshot()))
+        return state
+
+    def restore(self, state):
+        """
+        Continues from a state returned by snapshot().
+        """
+        self.tracker.restore(unprefixed('sort', state))
+        self.ids = state['vehicle_ids'].astype(np.int64)
+        self.bboxes = state['vehicle_bboxes'].astype(float).reshape(-1, 4)
+        self.paths = []
+        for obj_id, boxes, total in zip(self.ids.tolist(), np.split(state['paths'], np.cumsum(state['path_lengths'])[:-1]),
+                                        state['path_totals']):
+            path = TrajectoryBuffer(self.path_capacity, track_id=obj_id)
+            path.extend(boxes)
+            path.total, path.spill = int(total), self.spill
+            self.paths.append(path)
+        self.drawn = np.array([path.total for path in self.paths], dtype=np.int64)
+        self.extent = state['global_extent'].astype(float)
+        self.log.restore(unprefixed('log', state))
+        self.overlay.restore(unprefixed('overlay', state))
+
+def next_segment_path(output_path):
+    """
+    Returns <stem>.part<N><ext> next to output_path for the first N from 1
+    that is not taken yet.
+    """
+    stem, ext = os.path.splitext(output_path)
+    n = 1
+    while os.path.exists(f"{stem}.part{n}{ext}"):
+        n += 1
+    return f"{stem}.part{n}{ext}"
+
+def find_vehicle_boundaries(video_path, max_frames=250, checkpoint_path=None, checkpoint_every=1000, warmup_frames=500,
+                            output_path=None, output_csv=None, background_cache=None, restart=False):
+    """
+    Tracks the video and returns the VehicleTracker's BoundaryLog, or None
+    when the video cannot be opened. With an output_csv the boundary rows are
+    streamed there during the run instead of being kept in memory.
+
+    With a checkpoint_path the tracking state is saved there every
+    checkpoint_every frames and at the end, and a run finding a checkpoint
+    resumes from it by seeking the video. OpenCV does not expose the MOG2
+    model, so the background is re-learned from the warmup_frames frames
+    before the checkpoint; from checkpoints within the first warmup_frames
+    frames the resumed run is identical to an uninterrupted one; a run that
+    streams its CSV continues the file the checkpointed run was writing,
+    and a checkpoint of such a run cannot be resumed without output_csv
+    (ValueError). restart=True ignores the checkpoint and starts over.
+
+    With an output_path every frame is also annotated with the tracks and
+    boundaries and written there, in the same pass, which also fills the
+    road boundaries. A video cannot be continued, so a run resuming an
+    unfinished checkpoint renders the frames after it to a new segment next
+    to output_path, <stem>.part<N><ext> with the first free N, and leaves
+    the frames before it where they are; after a finished run the video is
+    left as it is.
+
+    With a background_cache directory the background model starts from the
+    one cached for this video by earlier runs, see background_cache.py, and
+    the cache is refreshed as the run goes.
+    """
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print("Error: Could not open video.")
-        return [], []
-
-    bg_subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50)
+        return None
+
+    state = load_checkpoint(checkpoint_path, 'vehicle_tracker') if checkpoint_path and not restart else None
+    if state is not None and state['log.offsets'][0] >= 0 and not output_csv:
+        cap.release()
+        raise ValueError(f"{checkpoint_path} was taken while streaming a CSV, pass that output_csv to resume it")
+    if state is not None and output_path:
+        done = int(state['frame_count'])
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if done >= max_frames or 0 < total_frames <= done:
+            if not os.path.exists(output_path):
+                print(f"{checkpoint_path} is of a finished run but {output_path} is missing, restart to render it")
+            output_path = None  # the finished run's video stays as it is
+        else:
+            segment = next_segment_path(output_path)
+            print(f"Rendering the frames after {done} to {segment}, {output_path} holds those before")
+            output_path = segment
+
+    out = None
+    if output_path:
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        out = cv2.VideoWriter(output_path, fourcc, 20.0, (int(cap.get(3)), int(cap.get(4))))
+
+    detector = BlobDetector(cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50))
     tracker = VehicleTracker()
     frame_count = 0
 
+    cache = None
+    if background_cache:
+        cache = BackgroundCache(background_cache, video_fingerprint(video_path) + '-roi')
+        frame_shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+        if cache.load() and cache.seed(detector.bg_subtractor, detector.roi_shape(frame_shape)):
+            print(f"Background model seeded from {cache.path}")
+
+    if state is not None:
+        frame_count = int(state['frame_count'])
+        tracker.restore(state)
+        start = max(frame_count - warmup_frames, 0)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for _ in range(frame_count - start):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            detector.apply(frame)
+        print(f"Resuming from frame {frame_count} of {checkpoint_path}")
+    if output_csv:
+        tracker.stream_csv(output_csv)
+
     while frame_count < max_frames:
         ret, frame = cap.read()
         if not ret:
             break
 
         frame_count += 1
-        height, width = frame.shape[:2]
-        roi_frame = frame[int(height * 0.4):, :]
-
-        fg_mask = bg_subtractor.apply(roi_frame)
-        fg_mask = cv2.threshold(fg_mask, 230, 255, cv2.THRESH_BINARY)[1]
-        fg_mask = cv2.erode(fg_mask, None, iterations=3)
-        fg_mask = cv2.dilate(fg_mask, None, iterations=2)
-
-        contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        detections = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            x += 0
-            y += int(height * 0.4)
-            if w > 30 and h > 30:
-                detections.append([x, y, x + w, y + h, 1])
+        detections = detector.detect(frame)
+        if cache is not None:
+            cache.observe(detector.crop(frame), detector.bg_subtractor)
 
         tracker.update(detections)
         tracker.record_boundaries(frame_count)
+        if out is not None:
+            tracker.draw(frame)
+            tracker.detect_direction_and_draw_boundaries(frame)
+            tracker.draw_static_boundaries(frame)
+            out.write(frame)
+
+        if checkpoint_path and checkpoint_every and frame_count % checkpoint_every == 0:
+            save_checkpoint(checkpoint_path, 'vehicle_tracker', dict(tracker.snapshot(), frame_count=np.array(frame_count)))
 
     cap.release()
-    return tracker.frame_boundaries, tracker.road_boundaries
+    if out is not None:
+        out.release()
+    if cache is not None:
+        cache.save(detector.bg_subtractor)
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, 'vehicle_tracker', dict(tracker.snapshot(), frame_count=np.array(frame_count)))
+    tracker.close()
+    return tracker.log
+
+def find_vehicle_boundaries_offline(video_path, max_frames=250):
+    """
+    Like find_vehicle_boundaries, but detects on the whole clip first and then
+    tracks it at once with offline_sort.track_offline, so the boundaries are
+    taken from RTS-smoothed paths.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("Error: Could not open video.")
+        return None
+
+    detector = BlobDetector(cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50))
+    # VehicleTracker skips frames without detections, so Sort steps only on
+    # frames that have some; steps[i] is frame i+1's step, 0 for none
+    rows = []
+    steps = []
+    step = 0
+    while len(steps) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        detections = detector.detect(frame)
+        if len(detections):
+            step += 1
+            rows.append(np.column_stack((np.full(len(detections), step), detections)))
+            steps.append(step)
+        else:
+            steps.append(0)
+    cap.release()
+
+    tracked = track_offline(np.concatenate(rows + [np.empty((0, 6))]))
+    bounds = np.searchsorted(tracked[:, 0], np.arange(len(steps) + 2) - 0.5)
+    tracker = VehicleTracker()
+    for frame_count, step in enumerate(steps, 1):
+        if step:
+            tracker.update_tracked(tracked[bounds[step]:bounds[step + 1]][:, [2, 3, 4, 5, 1]])
+        tracker.record_boundaries(frame_count)
+    tracker.close()
+    return tracker.log
 
 def save_boundaries_to_csv(boundaries, road_boundaries, output_csv):
     with open(output_csv, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        for boundary in boundaries:
-            writer.writerow(boundary)
-        
-        writer.writerow([])
-        writer.writerow(["Vehicle_ID", "Initial_BBox", "Current_BBox"])
-        for road_boundary in road_boundaries:
-            writer.writerow(road_boundary)
-
-def mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames=250):
-    boundaries, road_boundaries = find_vehicle_boundaries(video_path, max_frames)
-    if not boundaries and not road_boundaries:
+        write_boundaries_csv(file, boundaries, road_boundaries)
+
+def mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames=250, checkpoint_path=None,
+                            checkpoint_every=1000, single_pass=True, background_cache=None, restart=False):
+    """
+    Writes the boundary CSV and the annotated video. By default both come
+    from one pass that decodes, detects and tracks every frame once, so the
+    video shows exactly the tracks the CSV was made from. single_pass=False
+    keeps the older two passes, the second re-tracking the video with its
+    own mask pipeline just for drawing. background_cache and restart are
+    passed on to find_vehicle_boundaries.
+    """
+    if single_pass:
+        log = find_vehicle_boundaries(video_path, max_frames, checkpoint_path, checkpoint_every,
+                                      output_path=output_path, output_csv=output_csv,
+                                      background_cache=background_cache, restart=restart)
+        if log is None or not len(log.frames) and not len(log.roads):
+            print("Error: No boundaries found. Ensure the video path is correct.")
+            return
+        print("Final output video saved as:", output_path)
+        print("CSV file with boundaries saved as:", output_csv)
+        return
+
+    log = find_vehicle_boundaries(video_path, max_frames, checkpoint_path, checkpoint_every,
+                                  background_cache=background_cache, restart=restart)
+    if log is None or not len(log.frames) and not len(log.roads):
         print("Error: No boundaries found. Ensure the video path is correct.")
         return
 
-    save_boundaries_to_csv(boundaries, road_boundaries, output_csv)
+    save_boundaries_to_csv(log.frames.array(), log.roads.array(), output_csv)
 
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print("Error: Could not open video.")
         return
 
-    bg_subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50)
+    # the drawing pass smooths the foreground mask before thresholding it
+    detector = BlobDetector(cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=50),
+                            threshold=190, erode=2, dilate=3, blur=5)
     tracker = VehicleTracker()
     frame_count = 0
 
@@ -176,24 +356,7 @@ def mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames=250)
             break
 
         frame_count += 1
-        height, width = frame.shape[:2]
-        roi_frame = frame[int(height * 0.4):, :]
-
-        fg_mask = bg_subtractor.apply(roi_frame)
-        fg_mask = cv2.GaussianBlur(fg_mask, (5, 5), 0)
-        fg_mask = cv2.threshold(fg_mask, 190, 255, cv2.THRESH_BINARY)[1]
-        fg_mask = cv2.erode(fg_mask, None, iterations=2)
-        fg_mask = cv2.dilate(fg_mask, None, iterations=3)
-
-        contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        detections = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            x += 0
-            y += int(height * 0.4)
-            if w > 30 and h > 30:
-                detections.append([x, y, x + w, y + h, 1])
+        detections = detector.detect(frame)
 
         tracker.update(detections)
         tracker.draw(frame)
@@ -204,16 +367,25 @@ def mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames=250)
 
     cap.release()
     out.release()
+    tracker.close()
 
     print("Final output video saved as:", output_path)
     print("CSV file with boundaries saved as:", output_csv)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("Usage: python blobtracking1.py <input_video> <output_video> <output_csv> <max_frames>")
+    # --restart ignores an existing checkpoint and starts over
+    restart = '--restart' in sys.argv
+    argv = [arg for arg in sys.argv if arg != '--restart']
+    if len(argv) not in (5, 6, 7, 8):
+        print("Usage: python blobtracking1.py <input_video> <output_video> <output_csv> <max_frames> "
+              "[<checkpoint_path> [<checkpoint_every> [<background_cache_dir>]]] [--restart]  (\"\" for no checkpoint)")
     else:
-        video_path = sys.argv[1]
-        output_path = sys.argv[2]
-        output_csv = sys.argv[3]
-        max_frames = int(sys.argv[4])
-        mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames)
+        video_path = argv[1]
+        output_path = argv[2]
+        output_csv = argv[3]
+        max_frames = int(argv[4])
+        checkpoint_path = argv[5] or None if len(argv) > 5 else None
+        checkpoint_every = int(argv[6]) if len(argv) > 6 else 1000
+        background_cache = argv[7] if len(argv) > 7 else None
+        mark_vehicle_boundaries(video_path, output_path, output_csv, max_frames, checkpoint_path, checkpoint_every,
+                                background_cache=background_cache, restart=restart)
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path, kind, state):
+    """
+    Writes a flat dict of arrays as a compressed .npz tagged with the format
+    version and the kind of state it holds. The file is written next to `path`
+    and renamed over it, so a crash mid-write leaves the previous checkpoint.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        np.savez_compressed(fp, format_version=np.array(CHECKPOINT_VERSION), kind=np.array(kind), **state)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, kind):
+    """
+    Returns the state dict saved by save_checkpoint(), or None when there is
+    no checkpoint at `path`.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        version = int(data['format_version'])
+        if version != CHECKPOINT_VERSION:
+            raise ValueError("%s: checkpoint format %d, expected %d" % (path, version, CHECKPOINT_VERSION))
+        if str(data['kind']) != kind:
+            raise ValueError("%s holds a %r checkpoint, not %r" % (path, str(data['kind']), kind))
+        return {key: data[key] for key in data.files if key not in ('format_version', 'kind')}
+
+
+def prefixed(prefix, state):
+    """
+    Nests one component's state into another's under `prefix`.
+    """
+    return {prefix + '.' + key: value for key, value in state.items()}
+
+
+def unprefixed(prefix, state):
+    start = len(prefix) + 1
+    return {key[start:]: value for key, value in state.items() if key.startswith(prefix + '.')}
@@ -0,0 +1,149 @@
+import json
+
+import cv2
+import numpy as np
+
+from lattice import MIN_CONTOUR_AREA
+
+
+def load_lanes(path):
+    """
+    Reads lane definitions from a JSON file of the form
+
+        {"num_rows": 8, "num_cols": 8,
+         "lanes": [{"name": "lane1", "polygon": [[x, y], ...],
+                    "corners": [[x, y], [x, y], [x, y], [x, y]],
+                    "num_rows": 8, "num_cols": 8}, ...]}
+
+    "corners" are the far-left, far-right, near-right and near-left corners
+    the lattice is stretched between, so rows follow the road's perspective.
+    They default to the polygon itself when it has four points; a polygon
+    with more points only clips the lattice. Per-lane grid sizes override
+    the file-wide ones.
+    """
+    with open(path) as fp:
+        config = json.load(fp)
+
+    lanes = []
+    for index, lane in enumerate(config['lanes']):
+        polygon = [tuple(point) for point in lane['polygon']]
+        corners = [tuple(point) for point in lane.get('corners', polygon)]
+        if len(corners) != 4:
+            raise ValueError("lane %r needs four corners to lay out its lattice" % lane.get('name', index))
+        lanes.append({'name': lane.get('name', 'lane%d' % (index + 1)),
+                      'polygon': polygon,
+                      'corners': corners,
+                      'num_rows': lane.get('num_rows', config.get('num_rows', 8)),
+                      'num_cols': lane.get('num_cols', config.get('num_cols', 8))})
+    return lanes
+
+
+def lane_homography(corners, num_rows, num_cols):
+    """
+    Maps lattice coordinates (col, row) onto the image.
+    """
+    lattice = np.float32([[0, 0], [num_cols, 0], [num_cols, num_rows], [0, num_rows]])
+    return cv2.getPerspectiveTransform(lattice, np.float32(corners))
+
+
+def lane_box(lanes):
+    points = np.array([point for lane in lanes for point in lane['polygon'] + lane['corners']], dtype=float)
+    x1, y1 = np.floor(points.min(axis=0)).astype(int)
+    x2, y2 = np.ceil(points.max(axis=0)).astype(int) + 1
+    return max(x1, 0), max(y1, 0), x2, y2
+
+
+def seam_mask(labels):
+    """
+    Marks the higher-numbered side of every 8-neighbour pair that lies in two
+    different cells, so connected components can never cross between cells.
+    """
+    height, width = labels.shape
+    padded = np.pad(labels, 1, constant_values=-1)
+    seams = np.zeros(labels.shape, dtype=bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            neighbour = padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+            seams |= (neighbour >= 0) & (labels > neighbour)
+    return seams
+
+
+class PolygonLattice(object):
+    """
+    Lattice over perspective lane polygons.
+
+    A per-pixel map of cell indices over the lanes' bounding box is built once
+    at startup; counting a frame is then one blur/threshold/dilate, one
+    connected-components pass and one lookup in that map for all lanes
+    together. A cell's count is the number of connected blobs of at least
+    min_area pixels inside it.
+
+    This is not the rule of the rectangle engine (lattice.lattice_counts),
+    which blurs and dilates every cell's tile on its own and counts the
+    contours whose contourArea reaches min_area. Lanes laid out on exactly
+    the cells of the default ROIs, like those in lanes.json, therefore still
+    report different occupancy than the ROIs do.
+    """
+
+    def __init__(self, lanes, min_area=MIN_CONTOUR_AREA):
+        self.lanes = lanes
+        self.min_area = min_area
+        self.box = lane_box(lanes)
+        x1, y1, x2, y2 = self.box
+
+        self.labels = np.full((y2 - y1, x2 - x1), -1, dtype=np.int32)
+        self.offsets = []
+        self.cell_polygons = []
+        offset = 0
+        for lane in lanes:
+            num_rows, num_cols = lane['num_rows'], lane['num_cols']
+            homography = lane_homography(lane['corners'], num_rows, num_cols)
+
+            inside = np.zeros(self.labels.shape, dtype=np.uint8)
+            polygon = np.int32([[x - x1, y - y1] for x, y in lane['polygon']])
+            cv2.fillPoly(inside, [polygon], 1)
+            ys, xs = np.nonzero(inside)
+            pixels = np.stack([xs + x1, ys + y1], axis=1).astype(np.float32).reshape(-1, 1, 2)
+            lattice = cv2.perspectiveTransform(pixels, np.linalg.inv(homography)).reshape(-1, 2)
+            cols, rows = np.floor(lattice[:, 0]).astype(int), np.floor(lattice[:, 1]).astype(int)
+            valid = (cols >= 0) & (cols < num_cols) & (rows >= 0) & (rows < num_rows)
+            # later lanes win where polygons overlap
+            self.labels[ys[valid], xs[valid]] = offset + rows[valid] * num_cols + cols[valid]
+
+            grid = np.float32([[col, row] for row in range(num_rows + 1) for col in range(num_cols + 1)])
+            grid = cv2.perspectiveTransform(grid.reshape(-1, 1, 2), homography).reshape(num_rows + 1, num_cols + 1, 2)
+            self.cell_polygons.append(np.int32([[grid[row, col], grid[row, col + 1],
+                                                 grid[row + 1, col + 1], grid[row + 1, col]]
+                                                for row in range(num_rows) for col in range(num_cols)]))
+            self.offsets.append(offset)
+            offset += num_rows * num_cols
+        self.num_cells = offset
+
+        keep = (self.labels >= 0) & ~seam_mask(self.labels)
+        self.keep = np.where(keep, 255, 0).astype(np.uint8)
+
+    def counts(self, channel):
+        """
+        Returns the number of qualifying blobs in every cell of every lane, flat.
+        """
+        height, width = channel.shape[:2]
+        labels = self.labels[:height, :width]
+
+        blur = cv2.GaussianBlur(channel, (5, 5), 0)
+        _, thresh = cv2.threshold(blur, 20, 255, cv2.THRESH_BINARY)
+        dilated = cv2.dilate(thresh, None, iterations=3)
+        foreground = cv2.bitwise_and(dilated, self.keep[:height, :width])
+
+        num_labels, components, stats, _ = cv2.connectedComponentsWithStats(foreground, connectivity=8)
+        cell_of = np.full(num_labels, -1, dtype=np.int64)
+        cell_of[components.ravel()] = labels.ravel()
+        qualifying = cell_of[1:][stats[1:, cv2.CC_STAT_AREA] >= self.min_area]
+        return np.bincount(qualifying, minlength=self.num_cells)
+
+    def split(self, flat):
+        """
+        Splits a flat per-cell array into one (num_rows, num_cols) matrix per lane.
+        """
+        return [np.asarray(flat[offset:offset + lane['num_rows'] * lane['num_cols']], dtype=int)
+                .reshape(lane['num_rows'], lane['num_cols'])
+                for offset, lane in zip(self.offsets, self.lanes)]
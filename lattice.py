@@ -0,0 +1,205 @@
+import functools
+
+import cv2
+import numpy as np
+
+MIN_CONTOUR_AREA = 100
+
+# GaussianBlur((5, 5)) reads 2 px around every pixel, so each cell is padded by
+# that much (BORDER_REFLECT_101, the OpenCV default) before the ROI is blurred
+# as one image. Blur, threshold and dilation then give exactly the pixels the
+# old per-cell calls produced.
+CELL_PAD = 2
+
+CHANNEL_CHOICES = {
+    'H': [0],
+    'S': [1],
+    'V': [2],
+    'H+S': [0, 1],
+    'H+V': [0, 2],
+    'S+V': [1, 2],
+    'H+S+V': [0, 1, 2],
+    'gray': 'gray'
+}
+
+
+def cell_tiles(channel, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols, pad=CELL_PAD):
+    roi = channel[roi_y:roi_y + num_rows * grid_height, roi_x:roi_x + num_cols * grid_width]
+    cells = roi.reshape(num_rows, grid_height, num_cols, grid_width).transpose(0, 2, 1, 3)
+    cells = np.pad(cells, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode='reflect')
+    tile_h, tile_w = grid_height + 2 * pad, grid_width + 2 * pad
+    return np.ascontiguousarray(cells.transpose(0, 2, 1, 3)).reshape(num_rows * tile_h, num_cols * tile_w)
+
+
+@functools.lru_cache(maxsize=None)
+def tile_border_mask(grid_width, grid_height, num_rows, num_cols, pad=CELL_PAD):
+    tile = np.zeros((grid_height + 2 * pad, grid_width + 2 * pad), dtype=bool)
+    tile[:pad, :] = True
+    tile[-pad:, :] = True
+    tile[:, :pad] = True
+    tile[:, -pad:] = True
+    return np.tile(tile, (num_rows, num_cols))
+
+
+def lattice_counts(channel, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols,
+                   min_area=MIN_CONTOUR_AREA, border=None):
+    """
+    Counts, for every cell of the ROI, the contours of area >= min_area that
+    process_channel() would have found in that cell.
+    """
+    if border is None:
+        border = tile_border_mask(grid_width, grid_height, num_rows, num_cols)
+    tiles = cell_tiles(channel, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols)
+
+    blur = cv2.GaussianBlur(tiles, (5, 5), 0)
+    _, thresh = cv2.threshold(blur, 20, 255, cv2.THRESH_BINARY)
+    thresh[border] = 0
+    dilated = cv2.dilate(thresh, None, iterations=3)
+    dilated[border] = 0
+
+    # RETR_LIST returns the same contours as RETR_TREE without building the hierarchy
+    contours, _ = cv2.findContours(dilated, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    counts = np.zeros(num_rows * num_cols, dtype=int)
+    if not contours:
+        return counts.reshape(num_rows, num_cols)
+
+    areas = np.array([cv2.contourArea(contour) for contour in contours])
+    origins = np.array([contour[0, 0] for contour in contours])
+    tile_h, tile_w = grid_height + 2 * CELL_PAD, grid_width + 2 * CELL_PAD
+    cell_ids = (origins[:, 1] // tile_h) * num_cols + origins[:, 0] // tile_w
+    counts += np.bincount(cell_ids[areas >= min_area], minlength=num_rows * num_cols)
+    return counts.reshape(num_rows, num_cols)
+
+
+def vote_cells(counts, vote='all'):
+    """
+    Combines per-channel contour counts of shape (channels, rows, cols).
+
+    vote='all' marks a cell when every channel found a contour (HSVpart4.py);
+    an integer k marks it when the channels found at least k contours in total
+    (parallel.py / parallel2.py).
+    """
+    if vote == 'all':
+        return np.all(counts > 0, axis=0)
+    return counts.sum(axis=0) >= vote
+
+
+def roi_in_frame(shape, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols):
+    return (roi_x >= 0 and roi_y >= 0 and
+            roi_x + num_cols * grid_width <= shape[1] and
+            roi_y + num_rows * grid_height <= shape[0])
+
+
+def union_box(rois, num_rows, num_cols):
+    x1 = min(roi_x for roi_x, _, _, _ in rois)
+    y1 = min(roi_y for _, roi_y, _, _ in rois)
+    x2 = max(roi_x + num_cols * grid_width for roi_x, _, grid_width, _ in rois)
+    y2 = max(roi_y + num_rows * grid_height for _, roi_y, _, grid_height in rois)
+    return max(x1, 0), max(y1, 0), x2, y2
+
+
+class RoiPreprocessor(object):
+    """
+    Frame differencing and colour conversion restricted to the lattice.
+
+    Only the union box of the ROIs (or an explicit box) is diffed and
+    converted, into buffers that are reused from frame to frame. Calling it
+    returns the selected planes of that box and the ROIs shifted into box
+    coordinates.
+    """
+
+    def __init__(self, channels, rois=(), num_rows=8, num_cols=8, box=None):
+        self.channels = channels
+        self.box = box or union_box(rois, num_rows, num_cols)
+        self.rois = [(roi_x - self.box[0], roi_y - self.box[1], grid_width, grid_height)
+                     for roi_x, roi_y, grid_width, grid_height in rois]
+        self.crop_shape = None
+
+    def _allocate(self, height, width):
+        self.crop_shape = (height, width)
+        self.diff = np.empty((height, width, 3), dtype=np.uint8)
+        if self.channels == 'gray':
+            self.planes = [np.empty((height, width), dtype=np.uint8)]
+        else:
+            self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+            self.planes = [np.empty((height, width), dtype=np.uint8) for _ in self.channels]
+
+    def crop(self, frame):
+        x1, y1, x2, y2 = self.box
+        return frame[y1:y2, x1:x2]
+
+    def difference(self, frame1, frame2):
+        crop1, crop2 = self.crop(frame1), self.crop(frame2)
+        if crop1.shape[:2] != self.crop_shape:
+            self._allocate(*crop1.shape[:2])
+        cv2.absdiff(crop1, crop2, dst=self.diff)
+        return self.diff
+
+    def convert(self):
+        if self.channels == 'gray':
+            cv2.cvtColor(self.diff, cv2.COLOR_BGR2GRAY, dst=self.planes[0])
+        else:
+            cv2.cvtColor(self.diff, cv2.COLOR_BGR2HSV, dst=self.hsv)
+            for plane, index in zip(self.planes, self.channels):
+                cv2.extractChannel(self.hsv, index, dst=plane)
+        return self.planes
+
+    def __call__(self, frame1, frame2):
+        self.difference(frame1, frame2)
+        return self.convert(), self.rois
+
+
+def process_channel(channel):
+    blur = cv2.GaussianBlur(channel, (5, 5), 0)
+    _, thresh = cv2.threshold(blur, 20, 255, cv2.THRESH_BINARY)
+    dilated = cv2.dilate(thresh, None, iterations=3)
+    contours, _ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def cell_counts(channel, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols, min_area=MIN_CONTOUR_AREA):
+    # per-cell reference path, kept for ROIs that run off the frame edge
+    counts = np.zeros((num_rows, num_cols), dtype=int)
+    for row in range(num_rows):
+        for col in range(num_cols):
+            grid_x = roi_x + col * grid_width
+            grid_y = roi_y + row * grid_height
+            grid_channel = channel[grid_y:grid_y + grid_height, grid_x:grid_x + grid_width]
+            if grid_channel.size == 0:
+                continue
+            contours = process_channel(grid_channel)
+            counts[row, col] = sum(1 for contour in contours if cv2.contourArea(contour) >= min_area)
+    return counts
+
+
+def process_lattice(channels_data, roi_x, roi_y, grid_width, grid_height, result_matrix, vote='all'):
+    num_rows, num_cols = result_matrix.shape
+    if roi_in_frame(channels_data[0].shape, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols):
+        counts = [lattice_counts(channel, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols)
+                  for channel in channels_data]
+    else:
+        counts = [cell_counts(channel, roi_x, roi_y, grid_width, grid_height, num_rows, num_cols)
+                  for channel in channels_data]
+    result_matrix[:] = vote_cells(np.stack(counts), vote)
+    return result_matrix
+
+
+def process_frame_pair(frame1, frame2, channels, rois, num_rows, num_cols, vote='all', preprocessor=None):
+    """
+    Runs the lattice on every (roi_x, roi_y, grid_width, grid_height) in rois
+    and returns one (num_rows, num_cols) result matrix per ROI. Pass a
+    RoiPreprocessor built for the same channels and rois to reuse its buffers.
+    """
+    if preprocessor is None:
+        preprocessor = RoiPreprocessor(channels, rois, num_rows, num_cols)
+    channels_data, crop_rois = preprocessor(frame1, frame2)
+    return process_planes(channels_data, crop_rois, num_rows, num_cols, vote)
+
+
+def process_planes(channels_data, rois, num_rows, num_cols, vote='all'):
+    matrices = []
+    for roi_x, roi_y, grid_width, grid_height in rois:
+        result_matrix = np.zeros((num_rows, num_cols), dtype=int)
+        process_lattice(channels_data, roi_x, roi_y, grid_width, grid_height, result_matrix, vote)
+        matrices.append(result_matrix)
+    return matrices
@@ -0,0 +1,227 @@
+import multiprocessing as mp
+import os
+import time
+
+import cv2
+import numpy as np
+
+from lanes import PolygonLattice, load_lanes
+from lattice import CHANNEL_CHOICES, RoiPreprocessor, process_planes, vote_cells
+from lattice_runner import LatticeRunner
+from occupancy_log import LaneOccupancyLogs, OccupancyLog, export_excel
+from occupancy_stats import OccupancyStats
+from output_writer import OutputWriter
+from pacing import HEADLESS, FramePacer
+
+_worker_analyzer = None
+
+
+def _init_worker(config):
+    global _worker_analyzer
+    _worker_analyzer = LatticeOccupancyAnalyzer(**config)
+
+
+def _process_job(job):
+    video_path, options = job
+    return _worker_analyzer.process_video(video_path, **options)
+
+
+class LatticeOccupancyAnalyzer(object):
+    """
+    Lattice occupancy pipeline of HSVpart4.py / parallel.py as a reusable object.
+
+    rois is a list of (x, y, width, height) rectangles, each split into a
+    num_rows x num_cols lattice. Alternatively lanes (see lanes.load_lanes)
+    describes perspective lane polygons with their own grid sizes; these are
+    counted by lanes.PolygonLattice, whose blob rule differs from that of the
+    rectangles, so lanes on the same cells as rois report other occupancy.
+    channels is a key of CHANNEL_CHOICES or a list of HSV plane indices, vote
+    is passed to lattice.vote_cells().
+
+    Frames analysed through pairs() / process_video() also feed self.stats,
+    an OccupancyStats over the last stats_window frames with decay weight
+    stats_alpha. process_video() starts it over for every video.
+    """
+
+    def __init__(self, rois=None, num_rows=8, num_cols=8, channels='H+S+V', vote='all', lanes=None,
+                 stats_window=300, stats_alpha=0.05):
+        if (rois is None) == (lanes is None):
+            raise ValueError("pass either rois or lanes")
+        self.config = dict(rois=rois and [tuple(roi) for roi in rois], num_rows=num_rows, num_cols=num_cols,
+                           channels=channels, vote=vote, lanes=lanes,
+                           stats_window=stats_window, stats_alpha=stats_alpha)
+        self.channels = CHANNEL_CHOICES[channels] if isinstance(channels, str) else list(channels)
+        self.vote = vote
+        self.lattice = None
+
+        if lanes is not None:
+            self.lattice = PolygonLattice(lanes)
+            self.rois = []
+            self.shapes = [(lane['num_rows'], lane['num_cols']) for lane in lanes]
+            num_rows, num_cols = self.shapes[0]
+            self.preprocessor = RoiPreprocessor(self.channels, box=self.lattice.box)
+        else:
+            self.rois = self.config['rois']
+            self.shapes = [(num_rows, num_cols)] * len(self.rois)
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.grid_rois = [(x, y, width // num_cols, height // num_rows) for x, y, width, height in self.rois]
+        if self.lattice is None:
+            self.preprocessor = RoiPreprocessor(self.channels, self.grid_rois, num_rows, num_cols)
+        self.stats = OccupancyStats(self.shapes, stats_window, stats_alpha)
+
+    @classmethod
+    def from_lanes_file(cls, path, channels='H+S+V', vote='all'):
+        return cls(channels=channels, vote=vote, lanes=load_lanes(path))
+
+    def process_frame_pair(self, frame1, frame2):
+        """
+        Returns one occupancy matrix per ROI or lane.
+        """
+        planes, crop_rois = self.preprocessor(frame1, frame2)
+        return self.process_planes(planes, crop_rois)
+
+    def process_planes(self, planes, crop_rois):
+        """
+        Lattice stage on the preprocessor's planes and ROIs.
+        """
+        if self.lattice is not None:
+            counts = np.stack([self.lattice.counts(plane) for plane in planes])
+            return self.lattice.split(vote_cells(counts, self.vote))
+        return process_planes(planes, crop_rois, self.num_rows, self.num_cols, self.vote)
+
+    def draw(self, frame, matrices):
+        if self.lattice is not None:
+            for state, colour in ((0, (0, 0, 255)), (1, (0, 255, 0))):
+                cells = [polygon for polygons, result_matrix in zip(self.lattice.cell_polygons, matrices)
+                         for polygon in polygons[result_matrix.ravel() == state]]
+                if cells:
+                    cv2.polylines(frame, cells, True, colour, 2)
+            return
+
+        for state, colour in ((0, (0, 0, 255)), (1, (0, 255, 0))):
+            for (roi_x, roi_y, grid_width, grid_height), result_matrix in zip(self.grid_rois, matrices):
+                for row, col in zip(*np.nonzero(result_matrix == state)):
+                    grid_x = roi_x + col * grid_width
+                    grid_y = roi_y + row * grid_height
+                    cv2.rectangle(frame, (int(grid_x), int(grid_y)),
+                                  (int(grid_x + grid_width), int(grid_y + grid_height)), colour, 2)
+
+    def pairs(self, cap, max_frames=None, workers=None):
+        """
+        Yields (frame_count, frame1, matrices) for consecutive frame pairs of cap,
+        on a LatticeRunner process pool when workers is given.
+        """
+        if workers:
+            runner = LatticeRunner(self, workers=workers)
+            for item in runner.run(cap, max_frames):
+                self.stats.update(item[2])
+                yield item
+            return
+
+        frame_count = 0
+        ret, frame1 = cap.read()
+        ret, frame2 = cap.read()
+        while ret and (max_frames is None or frame_count < max_frames):
+            if frame1.shape[:2] == frame2.shape[:2]:
+                frame_count += 1
+                matrices = self.process_frame_pair(frame1, frame2)
+                self.stats.update(matrices)
+                yield frame_count, frame1, matrices
+            frame1 = frame2
+            ret, frame2 = cap.read()
+
+    def process_video(self, video_path, output_path=None, frames_dir=None, log_path=None, excel_path=None,
+                      max_frames=None, workers=None, dump_every=1, jpeg_quality=95, queue_size=32,
+                      mode=HEADLESS, append=False):
+        """
+        Runs the lattice over a whole video, writing the annotated video,
+        per-frame JPEGs and the occupancy log for whichever paths are given.
+        Lanes on grids of different sizes are logged to one file per lane
+        (see LaneOccupancyLogs), and only the first is exported to Excel.
+        Video and JPEG encoding run on an OutputWriter thread; JPEGs are dumped
+        every dump_every frames (0 disables them).
+        mode='headless' runs as fast as possible without windows or per-frame
+        output; mode='realtime' shows the annotated frames, prints the matrices
+        and paces to the source frame rate.
+        append=True continues an existing occupancy log instead of replacing it.
+        Returns a summary dict with the frame count, throughput, writer stats
+        and a snapshot of the occupancy statistics.
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError("Could not open video: %s" % video_path)
+        self.stats.reset()
+
+        out = None
+        if output_path:
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            out = cv2.VideoWriter(output_path, fourcc, 20.0, (int(cap.get(3)), int(cap.get(4))))
+        writer = OutputWriter(out, frames_dir, dump_every, jpeg_quality, queue_size)
+        pacer = FramePacer(mode, cap.get(cv2.CAP_PROP_FPS), window='Lattice occupancy')
+        occupancy_log = None
+
+        start_time = time.perf_counter()
+        frame_count = 0
+        try:
+            # opened in here, so a log that cannot be continued still releases the video and writer
+            if log_path and len(set(self.shapes)) > 1:
+                # lanes on different grids are logged one file per lane
+                names = [lane['name'] for lane in self.lattice.lanes]
+                occupancy_log = LaneOccupancyLogs(log_path, self.shapes, names, append=append)
+            elif log_path:
+                occupancy_log = OccupancyLog(log_path, self.num_rows, self.num_cols, num_rois=len(self.shapes),
+                                             append=append)
+
+            for frame_count, frame1, matrices in self.pairs(cap, max_frames, workers):
+                if occupancy_log is not None:
+                    occupancy_log.append(*matrices)
+
+                self.draw(frame1, matrices)
+
+                if not pacer.headless:
+                    print("Result matrix for frame", frame_count)
+                    print(matrices[0])
+                    for lane, result_matrix in enumerate(matrices[1:], 2):
+                        print("Result matrix for lane", lane)
+                        print(result_matrix)
+
+                cv2.putText(frame1, "Frame: {}".format(frame_count), (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
+                # runner frames live in the shared ring and are overwritten later
+                writer.write(frame_count, frame1, copy=bool(workers))
+
+                if not pacer.wait(frame1):
+                    break
+        finally:
+            cap.release()
+            pacer.close()
+            writer.close()
+            if occupancy_log is not None:
+                occupancy_log.close()
+
+        if log_path and excel_path:
+            export_excel(occupancy_log.paths[0] if isinstance(occupancy_log, LaneOccupancyLogs) else log_path,
+                         excel_path)
+
+        elapsed = time.perf_counter() - start_time
+        return {'video': video_path, 'frames': frame_count, 'elapsed': elapsed,
+                'fps': frame_count / elapsed if elapsed > 0 else 0.0, 'writer': writer.stats,
+                'stats': self.stats.snapshot()}
+
+    def process_many(self, videos, workers=None, output_dir=None, max_frames=None):
+        """
+        Processes several videos on a pool of `workers` processes, each holding
+        one warm analyzer that is reused for every video it is given.
+        Writes <name>_lattice.mp4 and <name>_lattice.npy into output_dir,
+        replacing those of earlier runs, and returns the process_video() summaries in input order.
+        """
+        jobs = []
+        for video_path in videos:
+            stem = os.path.join(output_dir or '.', os.path.splitext(os.path.basename(video_path))[0])
+            jobs.append((video_path, dict(output_path=stem + '_lattice.mp4', log_path=stem + '_lattice.npy',
+                                          max_frames=max_frames)))
+
+        if workers == 1:
+            return [self.process_video(video_path, **options) for video_path, options in jobs]
+        with mp.Pool(workers, initializer=_init_worker, initargs=(self.config,)) as pool:
+            return pool.map(_process_job, jobs, chunksize=1)
@@ -0,0 +1,105 @@
+import collections
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_ring = None
+_ring_shm = None
+_analyzer = None
+
+
+def _attach(shm_name, shape, analyzer_class, config):
+    global _ring, _ring_shm, _analyzer
+    _ring_shm = shared_memory.SharedMemory(name=shm_name)
+    _ring = np.ndarray(shape, dtype=np.uint8, buffer=_ring_shm.buf)
+    _analyzer = analyzer_class(**config)
+
+
+def _analyze_slots(slot1, slot2):
+    return _analyzer.process_frame_pair(_ring[slot1], _ring[slot2])
+
+
+class LatticeRunner(object):
+    """
+    Spreads frame pairs over a process pool.
+
+    Decoded frames are copied once into a shared-memory ring of `slots`
+    frames; workers only receive the two slot numbers of their pair, so no
+    image is pickled. Every worker builds its own copy of the analyzer from
+    analyzer.config and calls its process_frame_pair(). Results are yielded
+    in frame order.
+    """
+
+    def __init__(self, analyzer, workers=None, slots=None):
+        self.analyzer_class = type(analyzer)
+        self.config = analyzer.config
+        self.workers = workers or os.cpu_count() or 1
+        # two frames per pair are held plus one in-flight pair per slot beyond that
+        self.slots = slots or 2 * self.workers + 2
+        self.frame_count = 0
+        self.elapsed = 0.0
+
+    @property
+    def fps(self):
+        return self.frame_count / self.elapsed if self.elapsed > 0 else 0.0
+
+    def run(self, cap, max_frames=None):
+        """
+        Yields (frame_count, frame1, matrices) for every pair read from cap.
+
+        frame1 is a view into the ring and is only valid until the next item is
+        requested; copy it to keep it.
+        """
+        ret, frame = cap.read()
+        if not ret:
+            return
+
+        shape = (self.slots,) + frame.shape
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        ring = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        window = self.slots - 2
+        start_time = time.perf_counter()
+        self.frame_count = 0
+
+        try:
+            with mp.Pool(self.workers, initializer=_attach, initargs=(shm.name, shape, self.analyzer_class, self.config)) as pool:
+                ring[0] = frame
+                pending = collections.deque()
+                submitted = 0
+                eof = False
+                while True:
+                    while not eof and len(pending) < window:
+                        if max_frames is not None and submitted >= max_frames:
+                            eof = True
+                            break
+                        ret, frame = cap.read()
+                        if not ret or frame.shape != shape[1:]:
+                            eof = True
+                            break
+                        slot1, slot2 = submitted % self.slots, (submitted + 1) % self.slots
+                        ring[slot2] = frame
+                        pending.append((slot1, pool.apply_async(_analyze_slots, (slot1, slot2))))
+                        submitted += 1
+
+                    if not pending:
+                        # let the workers exit and be reaped, so their CPU time shows in os.times()
+                        pool.close()
+                        pool.join()
+                        break
+                    slot1, result = pending.popleft()
+                    matrices = result.get()
+                    self.frame_count += 1
+                    self.elapsed = time.perf_counter() - start_time
+                    yield self.frame_count, ring[slot1], matrices
+        finally:
+            self.elapsed = time.perf_counter() - start_time
+            del ring
+            try:
+                shm.close()
+            except BufferError:
+                # the caller still holds the last frame view; unlinking is enough
+                pass
+            shm.unlink()
@@ -0,0 +1,131 @@
+"""
+Runs SORT over MOT-format detection files, one sequence per worker process.
+
+Each det.txt is parsed with a C loader and its rows are grouped by frame once
+(a stable sort on the frame column plus split offsets), so selecting a
+frame's detections is a slice rather than a scan of the whole sequence.
+Tracks are written in MOT format in one buffered write per sequence, and
+tracking fps is reported per sequence and for the whole run.
+"""
+import argparse
+import glob
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from sort import Sort
+
+MOT_FORMAT = '%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1'
+
+
+def load_detections(path):
+    """
+    Reads a comma separated MOT detection file into a float array.
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        return np.loadtxt(path, delimiter=',', ndmin=2)
+    return pd.read_csv(path, header=None, engine='c').to_numpy(dtype=float)
+
+
+def group_by_frame(seq_dets):
+    """
+    Returns the detections sorted by frame and, for frames 1..N, the offsets
+    such that frame f's rows are sorted[offsets[f - 1]:offsets[f]].
+    """
+    if not len(seq_dets):
+        return seq_dets, np.zeros(1, dtype=int)
+    sorted_dets = seq_dets[np.argsort(seq_dets[:, 0], kind='stable')]
+    frames = np.arange(int(sorted_dets[-1, 0]) + 1)
+    return sorted_dets, np.searchsorted(sorted_dets[:, 0], frames + 0.5)
+
+
+def track_sequence(seq_dets_fn, output_dir, max_age=1, min_hits=3, iou_threshold=0.3):
+    """
+    Tracks one sequence and writes <output_dir>/<seq>.txt. Returns the
+    sequence name, frame count and time spent in Sort.update.
+    """
+    seq = os.path.basename(os.path.dirname(os.path.dirname(seq_dets_fn)))
+    sorted_dets, offsets = group_by_frame(load_detections(seq_dets_fn))
+    mot_tracker = Sort(max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold)
+    rows = []
+    total_time = 0.0
+    for frame in range(1, len(offsets)):  # detection and frame numbers begin at 1
+        dets = sorted_dets[offsets[frame - 1]:offsets[frame], 2:7].copy()
+        dets[:, 2:4] += dets[:, 0:2]  # convert to [x1,y1,w,h] to [x1,y1,x2,y2]
+
+        start_time = time.perf_counter()
+        trackers = mot_tracker.update(dets)
+        total_time += time.perf_counter() - start_time
+
+        if len(trackers):
+            out = np.empty((len(trackers), 6))
+            out[:, 0] = frame
+            out[:, 1] = trackers[:, 4]
+            out[:, 2:4] = trackers[:, 0:2]
+            out[:, 4:6] = trackers[:, 2:4] - trackers[:, 0:2]
+            rows.append(out)
+
+    with open(os.path.join(output_dir, '%s.txt' % seq), 'w', buffering=1 << 20) as out_file:
+        if rows:
+            np.savetxt(out_file, np.concatenate(rows), fmt=MOT_FORMAT)
+    return seq, len(offsets) - 1, total_time
+
+
+def _track_job(job):
+    return track_sequence(*job)
+
+
+def evaluate(seq_dets_fns, output_dir='output', workers=None, max_age=1, min_hits=3, iou_threshold=0.3):
+    """
+    Tracks every sequence on a pool of `workers` processes (all cores by
+    default, in-process for workers=1). Returns a list of (seq, frames,
+    tracking time) in completion order.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    jobs = [(fn, output_dir, max_age, min_hits, iou_threshold) for fn in sorted(seq_dets_fns)]
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if workers == 1:
+        return [_track_job(job) for job in jobs]
+    with mp.Pool(workers) as pool:
+        return list(pool.imap_unordered(_track_job, jobs))
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='SORT evaluation over MOT sequences')
+    parser.add_argument("--seq_path", help="Path to detections.", type=str, default='data')
+    parser.add_argument("--phase", help="Subdirectory in seq_path.", type=str, default='train')
+    parser.add_argument("--output", help="Directory for the tracker output [output].", type=str, default='output')
+    parser.add_argument("--workers", help="Sequences tracked in parallel [all cores].", type=int, default=None)
+    parser.add_argument("--max_age",
+                        help="Maximum number of frames to keep alive a track without associated detections.",
+                        type=int, default=1)
+    parser.add_argument("--min_hits",
+                        help="Minimum number of associated detections before track is initialised.",
+                        type=int, default=3)
+    parser.add_argument("--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    pattern = os.path.join(args.seq_path, args.phase, '*', 'det', 'det.txt')
+    start = time.perf_counter()
+    results = evaluate(glob.glob(pattern), args.output, args.workers, args.max_age, args.min_hits,
+                       args.iou_threshold)
+    wall_time = time.perf_counter() - start
+
+    for seq, frames, total_time in sorted(results):
+        print("%-20s %6d frames %8.3f s %8.1f FPS" % (seq, frames, total_time, frames / total_time if total_time else 0))
+    total_frames = sum(frames for _, frames, _ in results)
+    total_time = sum(total_time for _, _, total_time in results)
+    if total_frames:
+        print("Total Tracking took: %.3f seconds for %d frames or %.1f FPS" % (
+            total_time, total_frames, total_frames / total_time if total_time else 0))
+        print("Wall time %.3f seconds over %d sequences, %.1f FPS overall" % (
+            wall_time, len(results), total_frames / wall_time))
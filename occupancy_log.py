@@ -0,0 +1,151 @@
+import ast
+import os
+
+import numpy as np
+
+MAGIC = b'\x93NUMPY\x01\x00'
+# the .npy header is rewritten in place on every flush, so it is padded to a fixed size
+HEADER_SIZE = 128
+
+
+def _header(shape):
+    text = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (tuple(shape),)
+    text = text.ljust(HEADER_SIZE - len(MAGIC) - 2 - 1) + '\n'
+    return MAGIC + len(text).to_bytes(2, 'little') + text.encode('latin1')
+
+
+def _read_shape(fp):
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not an occupancy log: %s" % fp.name)
+    length = int.from_bytes(fp.read(2), 'little')
+    if len(MAGIC) + 2 + length != HEADER_SIZE:
+        raise ValueError("not an occupancy log: %s" % fp.name)
+    return tuple(ast.literal_eval(fp.read(length).decode('latin1'))['shape'])
+
+
+class OccupancyLog(object):
+    """
+    Append-only store of per-frame result matrices.
+
+    Frames are buffered and written in chunks to a plain .npy file of shape
+    (frames, rois, rows, cols), so each frame costs the same no matter how
+    long the run is. The file opens with np.load(path, mmap_mode='r') at any
+    time after a flush; export_excel() rebuilds the result_matrix1.xlsx layout.
+    """
+
+    def __init__(self, path, num_rows=8, num_cols=8, num_rois=1, chunk_frames=256, append=False):
+        self.path = path
+        self.cell_shape = (num_rois, num_rows, num_cols)
+        self.buffer = np.zeros((chunk_frames,) + self.cell_shape, dtype=np.uint8)
+        self.buffered = 0
+        self.frames = 0
+
+        if append and os.path.exists(path):
+            self.fp = open(path, 'r+b')
+            shape = _read_shape(self.fp)
+            if shape[1:] != self.cell_shape:
+                self.fp.close()
+                raise ValueError("%s holds %r matrices, not %r" % (path, shape[1:], self.cell_shape))
+            self.frames = shape[0]
+            self.fp.seek(0, os.SEEK_END)
+        else:
+            self.fp = open(path, 'w+b')
+            self.fp.write(_header((0,) + self.cell_shape))
+
+    def append(self, *matrices):
+        self.buffer[self.buffered] = matrices
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.buffered:
+            self.fp.write(self.buffer[:self.buffered].tobytes())
+            self.frames += self.buffered
+            self.buffered = 0
+        self.fp.seek(0)
+        self.fp.write(_header((self.frames,) + self.cell_shape))
+        self.fp.seek(0, os.SEEK_END)
+        self.fp.flush()
+
+    def close(self):
+        if not self.fp.closed:
+            self.flush()
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.frames + self.buffered
+
+
+class LaneOccupancyLogs(object):
+    """
+    OccupancyLogs for lanes on grids of different sizes, which cannot share
+    one (frames, rois, rows, cols) array: lane i is logged on its own to
+    <stem>_<name><ext> of `path`. append() takes one matrix per lane.
+    """
+
+    def __init__(self, path, shapes, names=None, chunk_frames=256, append=False):
+        stem, ext = os.path.splitext(path)
+        names = names or ['lane%d' % (index + 1) for index in range(len(shapes))]
+        self.paths = ['%s_%s%s' % (stem, name, ext) for name in names]
+        self.logs = [OccupancyLog(lane_path, num_rows, num_cols, 1, chunk_frames, append)
+                     for lane_path, (num_rows, num_cols) in zip(self.paths, shapes)]
+
+    def append(self, *matrices):
+        for log, matrix in zip(self.logs, matrices):
+            log.append(matrix)
+
+    def flush(self):
+        for log in self.logs:
+            log.flush()
+
+    def close(self):
+        for log in self.logs:
+            log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.logs[0]) if self.logs else 0
+
+
+def load_log(path):
+    return np.load(path, mmap_mode='r')
+
+
+def export_excel(log_path, excel_path='result_matrix1.xlsx', roi=0):
+    """
+    Writes one ROI of the log in the layout append_to_excel() used to build:
+    one matrix per frame, separated by an empty row.
+    """
+    from openpyxl import Workbook
+
+    matrices = load_log(log_path)[:, roi]
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for index, matrix in enumerate(matrices):
+        if index:
+            sheet.append([])
+        for row in matrix.tolist():
+            sheet.append(row)
+    workbook.save(excel_path)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python occupancy_log.py <log.npy> <output.xlsx> [roi]")
+    else:
+        roi = int(sys.argv[3]) if len(sys.argv) == 4 else 0
+        export_excel(sys.argv[1], sys.argv[2], roi)
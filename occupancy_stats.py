@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+
+
+class OccupancyStats(object):
+    """
+    Running per-cell statistics over the occupancy matrices of several lanes.
+
+    Every update() costs the same whatever the run length: it bumps the
+    occupied-frame counters, advances an exponentially decayed occupancy with
+    weight `alpha` for the newest frame, and swaps the newest frame into a
+    ring of the last `window` frames while keeping the window sums current.
+    snapshot() can be called at any time, including from another thread.
+    """
+
+    def __init__(self, shapes, window=300, alpha=0.05):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.offsets = np.cumsum([0] + [rows * cols for rows, cols in self.shapes])
+        num_cells = int(self.offsets[-1])
+        self.window = window
+        self.alpha = alpha
+        self.lock = threading.Lock()
+
+        self.frames = 0
+        self.occupied = np.zeros(num_cells, dtype=np.int64)
+        self.decayed = np.zeros(num_cells, dtype=float)
+        self.recent = np.zeros((window, num_cells), dtype=np.uint8)
+        self.window_counts = np.zeros(num_cells, dtype=np.int64)
+        self.current = np.zeros(num_cells, dtype=np.uint8)
+
+    def reset(self):
+        """
+        Starts the statistics over, as for a new video.
+        """
+        with self.lock:
+            self.frames = 0
+            for values in (self.occupied, self.decayed, self.recent, self.window_counts, self.current):
+                values.fill(0)
+
+    def update(self, matrices):
+        cells = np.concatenate([np.asarray(matrix, dtype=np.uint8).ravel() for matrix in matrices])
+        with self.lock:
+            slot = self.frames % self.window
+            self.window_counts += cells
+            self.window_counts -= self.recent[slot]
+            self.recent[slot] = cells
+            self.occupied += cells
+            if self.frames:
+                self.decayed += self.alpha * (cells - self.decayed)
+            else:
+                self.decayed[:] = cells
+            self.current[:] = cells
+            self.frames += 1
+
+    def _lanes(self, values):
+        return [values[start:end].reshape(shape)
+                for start, end, shape in zip(self.offsets[:-1], self.offsets[1:], self.shapes)]
+
+    def snapshot(self):
+        """
+        Returns a dict with the frame count and, per lane, the occupancy ratio,
+        decayed occupancy and window counts per cell plus the lane density
+        (share of occupied cells) now, over the window and over the whole run.
+        """
+        with self.lock:
+            frames = self.frames
+            in_window = min(frames, self.window)
+            ratio = self.occupied / frames if frames else np.zeros(len(self.occupied))
+            window_ratio = self.window_counts / in_window if in_window else np.zeros(len(self.occupied))
+            lanes = []
+            for lane_ratio, decayed, counts, window_share, current in zip(
+                    self._lanes(ratio), self._lanes(self.decayed.copy()), self._lanes(self.window_counts.copy()),
+                    self._lanes(window_ratio), self._lanes(self.current)):
+                lanes.append({'ratio': lane_ratio,
+                              'decayed': decayed,
+                              'window_counts': counts,
+                              'density': float(current.mean()),
+                              'window_density': float(window_share.mean()),
+                              'mean_density': float(lane_ratio.mean())})
+        return {'frames': frames, 'window': in_window, 'lanes': lanes}
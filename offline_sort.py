@@ -0,0 +1,223 @@
+"""
+Offline SORT for recorded video.
+
+The forward pass is the batched Sort filter run over detections grouped by
+frame in advance, without building Sort.update's per-frame output. Every
+matrix of the model couples a box coordinate with its own velocity alone, so
+each covariance is three 2x2 blocks and a scalar: the forward pass keeps
+just those ten numbers per track and updates them elementwise, and records
+every track's filtered state and covariance blocks on every frame it lives
+through.
+
+A Rauch-Tung-Striebel smoother then runs backwards over all tracks at once.
+Tracks are laid out longest first, so the records d frames before their
+track's end form one contiguous slice whose successors are the head of the
+slice for d - 1, and each step is a few array operations on slices.
+"""
+import numpy as np
+
+from mot_eval import group_by_frame
+from sort import KalmanBoxBatch, Sort, convert_bboxes_to_z, convert_x_to_bboxes
+
+# state indices of the coupled (coordinate, velocity) pairs, and of each
+# component's partner in its pair (the fourth coordinate has none)
+POSITION, VELOCITY = slice(0, 3), slice(4, 7)
+PARTNER = [4, 5, 6, 3, 0, 1, 2]
+
+
+class BlockKalmanBatch(KalmanBoxBatch):
+    """
+    KalmanBoxBatch with every covariance kept as its nonzero blocks, in a
+    (N,10) array `cov`: the coordinate variances (4), the coordinate-velocity
+    covariances (3) and the velocity variances (3). Predict and update are
+    elementwise on those columns instead of 7x7 matrix products, and agree
+    with KalmanBoxBatch to rounding.
+    """
+    COV0 = np.concatenate((np.diag(KalmanBoxBatch.P0)[:4], np.zeros(3), np.diag(KalmanBoxBatch.P0)[VELOCITY]))
+    QP, QV = np.diag(KalmanBoxBatch.Q)[:4], np.diag(KalmanBoxBatch.Q)[VELOCITY]
+    RP = np.diag(KalmanBoxBatch.R)
+
+    def _allocate(self, capacity):
+        old = getattr(self, 'x', None)
+        self.boxes = np.empty((capacity, 4))
+        x = np.zeros((capacity, 7))
+        cov = np.zeros((capacity, 10))
+        counters = np.zeros((6, capacity), dtype=np.int64)
+        if old is not None:
+            x[:self.n] = self.x[:self.n]
+            cov[:self.n] = self.cov[:self.n]
+            counters[:, :self.n] = self.counters[:, :self.n]
+        self.x, self.cov, self.counters = x, cov, counters
+        self.id, self.hits, self.hit_streak, self.age, self.time_since_update, self.stream = counters
+
+    def add(self, bboxes, ids, stream=0):
+        k = len(bboxes)
+        if self.n + k > len(self.x):
+            self._allocate(max(2 * len(self.x), self.n + k))
+        new = slice(self.n, self.n + k)
+        self.x[new] = 0.
+        self.x[new, :4] = convert_bboxes_to_z(bboxes)
+        self.cov[new] = self.COV0
+        self.counters[:, new] = 0
+        self.id[new] = ids
+        self.stream[new] = stream
+        self.n += k
+
+    def keep(self, mask):
+        keep = np.flatnonzero(mask)
+        k = len(keep)
+        self.x[:k] = self.x[keep]
+        self.cov[:k] = self.cov[keep]
+        self.counters[:, :k] = self.counters[:, keep]
+        self.n = k
+
+    def predict(self, mask=None):
+        rows = slice(0, self.n) if mask is None else np.flatnonzero(mask)
+        x, cov = self.x[rows], self.cov[rows]
+        x[x[:, 6] + x[:, 2] <= 0, 6] = 0.
+        x[:, :3] += x[:, 4:]
+        p, c, v = cov[:, :4], cov[:, 4:7], cov[:, 7:]
+        p[:, :3] += 2 * c + v
+        p += self.QP
+        c += v
+        v += self.QV
+        if mask is not None:
+            self.x[rows] = x
+            self.cov[rows] = cov
+        self.age[rows] += 1
+        self.hit_streak[rows] *= self.time_since_update[rows] == 0
+        self.time_since_update[rows] += 1
+        return convert_x_to_bboxes(x, out=self.boxes[:len(x)])
+
+    def update(self, indices, bboxes):
+        if not len(indices):
+            return
+        x, cov = self.x[indices], self.cov[indices]
+        p, c, v = cov[:, :4], cov[:, 4:7], cov[:, 7:]
+        y = convert_bboxes_to_z(bboxes) - x[:, :4]
+        s = p + self.RP
+        gain_p, gain_c = p / s, c / s[:, :3]
+        x[:, :4] += gain_p * y
+        x[:, 4:] += gain_c * y[:, :3]
+        v -= gain_c * c
+        c -= gain_p[:, :3] * c
+        p -= gain_p * p
+        self.x[indices] = x
+        self.cov[indices] = cov
+        self.time_since_update[indices] = 0
+        self.hits[indices] += 1
+        self.hit_streak[indices] += 1
+
+    def snapshot(self):
+        return {'x': self.x[:self.n].copy(), 'cov': self.cov[:self.n].copy(), 'counters': self.counters[:, :self.n].copy()}
+
+    def restore(self, state):
+        n = len(state['x'])
+        if n > len(self.x):
+            self._allocate(n)
+        self.n = n
+        self.x[:n] = state['x']
+        self.cov[:n] = state['cov']
+        self.counters[:, :n] = state['counters']
+
+
+def forward_pass(detections, max_age=1, min_hits=3, iou_threshold=0.3):
+    """
+    Runs Sort over `detections`, rows of (frame, x1, y1, x2, y2, score) with
+    frames numbered from 1, and returns the per track per frame records as a
+    dict of arrays: id, frame, filtered state x, covariance blocks `cov` (see
+    BlockKalmanBatch) and `shown`, whether Sort.update reported the track on
+    that frame.
+    """
+    sorted_dets, offsets = group_by_frame(np.asarray(detections, dtype=float).reshape(-1, 6))
+    tracker = Sort(max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold)
+    tracks = tracker.tracks = BlockKalmanBatch()
+    records = {'id': [np.empty(0, dtype=np.int64)], 'x': [np.empty((0, 7))], 'cov': [np.empty((0, 10))],
+               'shown': [np.empty(0, dtype=bool)]}
+    counts = np.zeros(len(offsets), dtype=np.int64)
+    for frame in range(1, len(offsets)):
+        shown = tracker.associate(sorted_dets[offsets[frame - 1]:offsets[frame], 1:5], tracker.predict())
+        n = counts[frame] = len(tracks)
+        records['id'].append(tracks.id[:n].copy())
+        records['x'].append(tracks.x[:n].copy())
+        records['cov'].append(tracks.cov[:n].copy())
+        records['shown'].append(shown)
+        tracker.prune()
+    records = {key: np.concatenate(values) for key, values in records.items()}
+    records['frame'] = np.repeat(np.arange(len(offsets)), counts)
+    return records
+
+
+def rts_smooth(records):
+    """
+    Returns the smoothed states of the records of forward_pass(). Each
+    track's last state is its filtered one; every earlier state k becomes
+    x[k] + C (x_s[k+1] - x_pred[k+1]) with C = P[k] F' P_pred[k+1]^-1, where
+    x_pred[k+1] and P_pred[k+1] are the prediction made from x[k] and P[k].
+    On each block [[p, c], [c, v]] of P, C is the closed form 2x2 product.
+    """
+    if not len(records['id']):
+        return records['x'].copy()
+    # tracks longest first, then records by distance from their track's end
+    ids, first, length = np.unique(records['id'], return_index=True, return_counts=True)
+    rank = np.empty(len(ids), dtype=np.int64)
+    rank[np.lexsort((ids, -length))] = np.arange(len(ids))
+    track = np.searchsorted(ids, records['id'])
+    end = records['frame'][first] + length - 1
+    distance = end[track] - records['frame']
+    order = np.lexsort((rank[track], distance))
+    starts = np.searchsorted(distance[order], np.arange(length.max() + 1))
+
+    # one contiguous row per state component and per covariance entry
+    x = records['x'][order].T.copy()
+    cov = records['cov'][order].T.copy()
+    p, c, v = cov[:4], cov[4:7], cov[7:]
+    x_pred = x.copy()
+    x_pred[6, x_pred[6] + x_pred[2] <= 0] = 0.
+    x_pred[:3] += x_pred[4:]
+    # C of each block [[p, c], [c, v]] from its prediction [[a, b], [b, d]]: `same`
+    # weighs a component's own successor, `cross` that of its block partner
+    a = p + BlockKalmanBatch.QP[:, None]
+    a[:3] += 2 * c + v
+    b, d = c + v, v + BlockKalmanBatch.QV[:, None]
+    pc = p[:3] + c
+    det = a[:3] * d - b * b
+    same, cross = np.empty_like(x), np.zeros_like(x)
+    same[POSITION] = (pc * d - c * b) / det
+    cross[POSITION] = (c * a[:3] - pc * b) / det
+    cross[VELOCITY] = b * BlockKalmanBatch.QV[:, None] / det
+    same[VELOCITY] = (v * a[:3] - b * b) / det
+    same[3] = p[3] / a[3]
+    offset = x - same * x_pred - cross * x_pred[PARTNER]
+
+    smoothed = x
+    for step in range(1, len(starts) - 1):
+        rows = slice(starts[step], starts[step + 1])
+        after = smoothed[:, starts[step - 1]:starts[step - 1] + rows.stop - rows.start]
+        smoothed[:, rows] = offset[:, rows] + same[:, rows] * after + cross[:, rows] * after[PARTNER]
+
+    states = np.empty_like(records['x'])
+    states[order] = smoothed.T
+    return states
+
+
+def track_offline(detections, max_age=1, min_hits=3, iou_threshold=0.3, smooth=True):
+    """
+    Tracks a whole recording at once. `detections` holds rows of
+    (frame, x1, y1, x2, y2, score) with frames numbered from 1; frames
+    without rows are frames without detections.
+
+    Returns a (M,6) array of (frame, id, x1, y1, x2, y2) rows: the tracks
+    Sort.update would report on each frame, ordered by frame and then as
+    Sort.update orders them, with RTS-smoothed boxes unless smooth=False,
+    in which case they are Sort.update's boxes up to rounding.
+    """
+    records = forward_pass(detections, max_age, min_hits, iou_threshold)
+    states = rts_smooth(records) if smooth else records['x']
+    shown = np.flatnonzero(records['shown'])
+    shown = shown[np.lexsort((-records['id'][shown], records['frame'][shown]))]
+    result = np.empty((len(shown), 6))
+    result[:, 0] = records['frame'][shown]
+    result[:, 1] = records['id'][shown] + 1  # +1 as MOT benchmark requires positive
+    result[:, 2:] = convert_x_to_bboxes(states[shown])
+    return result
@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+
+class OutputWriter(object):
+    """
+    Background stage for the annotated video and per-frame JPEG dumps.
+
+    Frames go through a bounded queue to a writer thread, so encoding overlaps
+    with analysis (OpenCV releases the GIL while it encodes). When the disk
+    falls behind, write() blocks; the time spent blocked is kept in `stats` as
+    a measure of backpressure.
+    """
+
+    def __init__(self, video_writer=None, frames_dir=None, dump_every=1, jpeg_quality=95, queue_size=32):
+        self.video_writer = video_writer
+        self.frames_dir = frames_dir if dump_every else None
+        self.dump_every = dump_every
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {'frames': 0, 'dumps': 0, 'stalls': 0, 'stall_time': 0.0, 'max_depth': 0, 'write_time': 0.0}
+        self.error = None
+
+        if self.frames_dir and not os.path.exists(self.frames_dir):
+            os.makedirs(self.frames_dir)
+        self.thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            frame_count, frame = item
+            start = time.perf_counter()
+            try:
+                if self.video_writer is not None:
+                    self.video_writer.write(frame)
+                if self.frames_dir and frame_count % self.dump_every == 0:
+                    cv2.imwrite(os.path.join(self.frames_dir, f'frame_{frame_count:04d}.jpg'), frame, self.jpeg_params)
+                    self.stats['dumps'] += 1
+            except Exception as e:
+                self.error = e
+            self.stats['frames'] += 1
+            self.stats['write_time'] += time.perf_counter() - start
+
+    def write(self, frame_count, frame, copy=False):
+        """
+        Queues a frame; pass copy=True when the caller reuses the frame buffer.
+        """
+        if self.error is not None:
+            raise self.error
+        item = (frame_count, frame.copy() if copy else frame)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put(item)
+            self.stats['stalls'] += 1
+            self.stats['stall_time'] += time.perf_counter() - start
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.queue.qsize())
+
+    def close(self):
+        """
+        Drains the queue, releases the video writer and re-raises any write error.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
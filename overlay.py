@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+
+class SegmentOverlay(object):
+    """
+    Persistent canvas of line segments that stay on screen for the rest of a
+    video. Each segment is rasterised once, when it is added, into a mask per
+    layer; composite() paints the canvas onto a frame with one masked copy.
+    Later layers cover earlier ones, as if every segment of layer 0 had been
+    drawn on the frame, then every segment of layer 1, and so on, so the
+    per-frame cost no longer grows with the number of segments drawn so far.
+    """
+
+    def __init__(self, colors, thickness=2):
+        self.colors = np.array(colors, dtype=np.uint8)
+        self.thickness = thickness
+        self.masks = None
+        self.canvas = None
+        self.cover = None
+        self.dirty = None
+        self.pending = [[] for _ in colors]
+
+    def add(self, layer, segments):
+        """
+        Adds (N,4) segments (x1, y1, x2, y2) to `layer`. Segments added before
+        the first composite() are rasterised once the frame size is known.
+        """
+        segments = np.asarray(segments, dtype=np.int64).reshape(-1, 4)
+        if not len(segments):
+            return
+        if self.masks is None:
+            self.pending[layer].append(segments)
+            return
+        mask = self.masks[layer]
+        for x1, y1, x2, y2 in segments.tolist():
+            cv2.line(mask, (x1, y1), (x2, y2), 255, self.thickness)
+        pad = self.thickness
+        low = segments[:, [0, 1]].min(0), segments[:, [2, 3]].min(0)
+        high = segments[:, [0, 1]].max(0), segments[:, [2, 3]].max(0)
+        rect = np.concatenate((np.minimum(*low) - pad, np.maximum(*high) + pad + 1))
+        self.dirty = rect if self.dirty is None else np.concatenate((np.minimum(self.dirty[:2], rect[:2]),
+                                                                    np.maximum(self.dirty[2:], rect[2:])))
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self.masks = np.zeros((len(self.colors), height, width), dtype=np.uint8)
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        self.cover = np.zeros((height, width), dtype=np.uint8)
+        pending, self.pending = self.pending, [[] for _ in self.colors]
+        for layer, chunks in enumerate(pending):
+            for segments in chunks:
+                self.add(layer, segments)
+
+    def _refresh(self):
+        height, width = self.cover.shape[:2]
+        x1, y1 = max(int(self.dirty[0]), 0), max(int(self.dirty[1]), 0)
+        x2, y2 = min(int(self.dirty[2]), width), min(int(self.dirty[3]), height)
+        self.dirty = None
+        if x1 >= x2 or y1 >= y2:
+            return
+        masks = self.masks[:, y1:y2, x1:x2] > 0
+        canvas = self.canvas[y1:y2, x1:x2]
+        for color, mask in zip(self.colors, masks):
+            canvas[mask] = color
+        self.cover[y1:y2, x1:x2] = masks.any(0)
+
+    def composite(self, frame):
+        """
+        Paints every segment added so far onto `frame` in place.
+        """
+        if self.masks is None:
+            self._allocate(frame.shape)
+        if self.dirty is not None:
+            self._refresh()
+        cv2.copyTo(self.canvas, self.cover, frame)
+
+    def snapshot(self):
+        """
+        Returns the layer masks, plus segments not yet rasterised, as a flat
+        dict of arrays.
+        """
+        masks = self.masks if self.masks is not None else np.zeros((len(self.colors), 0, 0), dtype=np.uint8)
+        pending = [np.concatenate(chunks + [np.empty((0, 4), dtype=np.int64)]) for chunks in self.pending]
+        state = {'masks': masks}
+        state.update(('pending%d' % layer, segments) for layer, segments in enumerate(pending))
+        return state
+
+    def restore(self, state):
+        """
+        Continues from a state returned by snapshot().
+        """
+        self.masks = self.canvas = self.cover = self.dirty = None
+        self.pending = [[] for _ in self.colors]
+        for layer in range(len(self.colors)):
+            self.add(layer, state['pending%d' % layer])
+        if state['masks'].size:
+            masks = state['masks'].copy()
+            self._allocate(masks.shape[1:])
+            self.masks |= masks
+            self.dirty = np.array([0, 0, masks.shape[2], masks.shape[1]])
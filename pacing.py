@@ -0,0 +1,60 @@
+import time
+
+import cv2
+
+HEADLESS = 'headless'
+REALTIME = 'realtime'
+MODES = (HEADLESS, REALTIME)
+
+
+def check_mode(mode):
+    if mode not in MODES:
+        raise ValueError("mode must be one of %s, not %r" % (', '.join(MODES), mode))
+    return mode
+
+
+class FramePacer(object):
+    """
+    Holds a processing loop to the source frame rate.
+
+    In headless mode wait() returns immediately and no window is touched; in
+    realtime mode it sleeps until the next frame is due on the monotonic
+    clock, shows the frame when given one and reports ESC / 'q' presses.
+    """
+
+    def __init__(self, mode, fps, window=None):
+        self.mode = check_mode(mode)
+        self.period = 1.0 / fps if fps and fps > 0 else 0.0
+        self.window = window
+        self.next_time = None
+
+    @property
+    def headless(self):
+        return self.mode == HEADLESS
+
+    def wait(self, frame=None):
+        """
+        Returns False when the user asked to stop.
+        """
+        if self.headless:
+            return True
+
+        if self.window and frame is not None:
+            cv2.imshow(self.window, frame)
+        key = cv2.waitKey(1) & 0xFF
+
+        now = time.monotonic()
+        if self.next_time is None:
+            self.next_time = now
+        self.next_time += self.period
+        delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # running late: restart the schedule instead of bursting to catch up
+            self.next_time = now
+        return key not in (27, ord('q'))
+
+    def close(self):
+        if not self.headless:
+            cv2.destroyAllWindows()
@@ -17,31 +17,69 @@
 """
 from __future__ import print_function
 
-import os
 import numpy as np
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from skimage import io
 
-import glob
-import time
-import argparse
-from filterpy.kalman import KalmanFilter
+from trajectory import TrajectoryBuffer
 
-np.random.seed(0)
 
+# above this many detection x tracker pairs the association is gated spatially
+DENSE_MAX_PAIRS = 200 * 200
 
-def linear_assignment(cost_matrix):
-  try:
-    import lap
+
+def _lap_solver():
+  import lap
+  def solve(cost_matrix):
     _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-    return np.array([[y[i],i] for i in x if i >= 0]) #
-  except ImportError:
-    from scipy.optimize import linear_sum_assignment
+    cols = x[x >= 0]
+    return np.stack((y[cols], cols), axis=1)
+  return solve
+
+
+def _scipy_solver():
+  from scipy.optimize import linear_sum_assignment
+  def solve(cost_matrix):
     x, y = linear_sum_assignment(cost_matrix)
-    return np.array(list(zip(x, y)))
+    return np.stack((x, y), axis=1)
+  return solve
+
+
+def greedy_assignment(cost_matrix):
+  """
+  Fallback solver: repeatedly takes the cheapest pair whose row and column are both still free.
+  Pairs come back sorted by row, as the other solvers return them.
+  """
+  rows, cols = np.unravel_index(np.argsort(cost_matrix, axis=None, kind='stable'), cost_matrix.shape)
+  row_free = np.ones(cost_matrix.shape[0], dtype=bool)
+  col_free = np.ones(cost_matrix.shape[1], dtype=bool)
+  pairs = []
+  for r, c in zip(rows, cols):
+    if row_free[r] and col_free[c]:
+      row_free[r] = col_free[c] = False
+      pairs.append((r, c))
+      if len(pairs) == min(cost_matrix.shape):
+        break
+  pairs = np.array(pairs, dtype=int).reshape(-1, 2)
+  return pairs[np.argsort(pairs[:, 0], kind='stable')]
+
+
+_solver = None
+
+def linear_assignment(cost_matrix):
+  """
+  Solves the assignment with lap.lapjv, scipy or, failing both, greedily.
+  The backend is looked up on the first call and kept.
+  """
+  global _solver
+  if _solver is None:
+    for loader in (_lap_solver, _scipy_solver):
+      try:
+        _solver = loader()
+        break
+      except ImportError:
+        pass
+    else:
+      _solver = greedy_assignment
+  return _solver(cost_matrix)
 
 
 def iou_batch(bb_test, bb_gt):
@@ -50,17 +88,174 @@ def iou_batch(bb_test, bb_gt):
   """
   bb_gt = np.expand_dims(bb_gt, 0)
   bb_test = np.expand_dims(bb_test, 1)
-  
-  xx1 = np.maximum(bb_test[..., 0], bb_gt[..., 0])
-  yy1 = np.maximum(bb_test[..., 1], bb_gt[..., 1])
-  xx2 = np.minimum(bb_test[..., 2], bb_gt[..., 2])
-  yy2 = np.minimum(bb_test[..., 3], bb_gt[..., 3])
-  w = np.maximum(0., xx2 - xx1)
-  h = np.maximum(0., yy2 - yy1)
+
+  # same arithmetic as before, but in place so only three N x M arrays are allocated
+  w = np.minimum(bb_test[..., 2], bb_gt[..., 2])
+  w -= np.maximum(bb_test[..., 0], bb_gt[..., 0])
+  np.maximum(w, 0., out=w)
+  h = np.minimum(bb_test[..., 3], bb_gt[..., 3])
+  h -= np.maximum(bb_test[..., 1], bb_gt[..., 1])
+  np.maximum(h, 0., out=h)
+  wh = w
+  wh *= h
+  union = np.add((bb_test[..., 2] - bb_test[..., 0]) * (bb_test[..., 3] - bb_test[..., 1]),
+                 (bb_gt[..., 2] - bb_gt[..., 0]) * (bb_gt[..., 3] - bb_gt[..., 1]), out=h)
+  union -= wh
+  wh /= union
+  return(wh)
+
+
+def iou_pairs(bb_test, bb_gt):
+  """
+  IOU between row-aligned bboxes: bb_test[i] against bb_gt[i].
+  """
+  w = np.maximum(0., np.minimum(bb_test[:, 2], bb_gt[:, 2]) - np.maximum(bb_test[:, 0], bb_gt[:, 0]))
+  h = np.maximum(0., np.minimum(bb_test[:, 3], bb_gt[:, 3]) - np.maximum(bb_test[:, 1], bb_gt[:, 1]))
   wh = w * h
-  o = wh / ((bb_test[..., 2] - bb_test[..., 0]) * (bb_test[..., 3] - bb_test[..., 1])                                      
-    + (bb_gt[..., 2] - bb_gt[..., 0]) * (bb_gt[..., 3] - bb_gt[..., 1]) - wh)                                              
-  return(o)  
+  return wh / ((bb_test[:, 2] - bb_test[:, 0]) * (bb_test[:, 3] - bb_test[:, 1])
+    + (bb_gt[:, 2] - bb_gt[:, 0]) * (bb_gt[:, 3] - bb_gt[:, 1]) - wh)
+
+
+def overlapping_pairs(bb_test, bb_gt):
+  """
+  Returns the (test, gt) index arrays of every pair of overlapping bboxes. The gt
+  boxes are sorted by left edge, so each test box only looks at the gt boxes whose
+  left edge lies within one gt width before its own right edge.
+  """
+  if not len(bb_test) or not len(bb_gt):
+    return np.empty(0, dtype=int), np.empty(0, dtype=int)
+  order = np.argsort(bb_gt[:, 0], kind='stable')
+  left = bb_gt[order, 0]
+  max_width = (bb_gt[:, 2] - bb_gt[:, 0]).max()
+  lo = np.searchsorted(left, bb_test[:, 0] - max_width, side='right')
+  hi = np.searchsorted(left, bb_test[:, 2], side='left')
+  counts = np.maximum(hi - lo, 0)
+  test = np.repeat(np.arange(len(bb_test)), counts)
+  gt = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo, counts)]
+  overlap = ((np.minimum(bb_test[test, 2], bb_gt[gt, 2]) > np.maximum(bb_test[test, 0], bb_gt[gt, 0])) &
+             (np.minimum(bb_test[test, 3], bb_gt[gt, 3]) > np.maximum(bb_test[test, 1], bb_gt[gt, 1])))
+  return test[overlap], gt[overlap]
+
+
+def pair_components(rows, cols, num_rows):
+  """
+  Labels the connected components of the bipartite graph with edges rows[i]-cols[i];
+  row r is node r and column c is node num_rows + c. Each node gets the lowest node
+  id of its component.
+  """
+  a, b = rows, cols + num_rows
+  labels = np.arange(num_rows + (cols.max() + 1 if len(cols) else 0))
+  while True:
+    joined = labels.copy()
+    lowest = np.minimum(labels[a], labels[b])
+    np.minimum.at(joined, a, lowest)
+    np.minimum.at(joined, b, lowest)
+    joined = joined[joined]
+    if np.array_equal(joined, labels):
+      return labels
+    labels = joined
+
+
+def rank_in_group(labels):
+  """
+  Returns each element's position among the elements with the same label, in index order.
+  """
+  order = np.argsort(labels, kind='stable')
+  counts = np.bincount(labels)
+  rank = np.empty(len(labels), dtype=int)
+  rank[order] = np.arange(len(labels)) - (np.cumsum(counts) - counts)[labels[order]]
+  return rank
+
+
+def gated_assignment(detections, trackers, iou_threshold, groups=None, tracker_groups=None,
+                     max_dense_pairs=DENSE_MAX_PAIRS):
+  """
+  Sparse counterpart of the dense IOU assignment for large scenes. IOU is only
+  computed for overlapping pairs, and each connected group of overlapping
+  detections and trackers is solved on its own; pairs that do not overlap have
+  zero IOU and could never survive the threshold anyway.
+
+  `groups` and `tracker_groups` optionally label every detection and tracker
+  with the independent problem it belongs to (no box of one group may overlap
+  a box of another). Each group is then associated as if on its own: the
+  shortcut taken when all pairs above the threshold are one-to-one is decided
+  per group, and a group of at most max_dense_pairs pairs is solved over its
+  dense IOU matrix, exactly as associate_detections_to_trackers would.
+
+  Like the dense solver, the assignment covers as many detections as it can,
+  low IOU pairs included: detections and trackers left over once the
+  overlapping ones are solved are paired up in index order within their
+  group. Where detections outnumber trackers, which of them the dense solver
+  leaves out depends on how it breaks ties between zero IOU pairs, so only
+  there may the sparse path order the unmatched detections differently.
+
+  Returns the (detection, tracker) index pairs, sorted by detection, and their IOU.
+  """
+  det_group = np.zeros(len(detections), dtype=int) if groups is None else np.asarray(groups, dtype=int)
+  trk_group = np.zeros(len(trackers), dtype=int) if tracker_groups is None else np.asarray(tracker_groups, dtype=int)
+  num_groups = max(det_group.max(initial=-1), trk_group.max(initial=-1)) + 1
+  det_count = np.bincount(det_group, minlength=num_groups)
+  trk_count = np.bincount(trk_group, minlength=num_groups)
+
+  rows, cols = overlapping_pairs(detections, trackers)
+  ious = iou_pairs(detections[rows], trackers[cols])
+  group = det_group[rows]
+  strong = ious > iou_threshold
+  clash = strong & ((np.bincount(rows[strong], minlength=len(detections))[rows] > 1) |
+                    (np.bincount(cols[strong], minlength=len(trackers))[cols] > 1))
+  shortcut = np.zeros(num_groups, dtype=bool)
+  shortcut[group[strong]] = True
+  shortcut[group[clash]] = False
+  dense = ~shortcut & (det_count * trk_count <= max_dense_pairs)
+  sparse = ~shortcut & ~dense
+
+  component = pair_components(rows, cols, len(detections))[rows]
+  sizes = np.bincount(component)[component]
+  # shortcut groups keep their strong pairs, elsewhere lone pairs need no solver
+  direct = np.where(shortcut[group], strong, sparse[group] & (sizes == 1))
+  matches = [np.stack((rows[direct], cols[direct]), axis=1)]
+  matched_iou = [ious[direct]]
+  shared = np.flatnonzero(sparse[group] & (sizes > 1))
+  shared = shared[np.argsort(component[shared], kind='stable')]
+  for edges in np.split(shared, np.flatnonzero(np.diff(component[shared])) + 1):
+    if not len(edges):
+      continue
+    sub_rows, r = np.unique(rows[edges], return_inverse=True)
+    sub_cols, c = np.unique(cols[edges], return_inverse=True)
+    cost = np.zeros((len(sub_rows), len(sub_cols)))
+    cost[r, c] = -ious[edges]
+    pairs = linear_assignment(cost)
+    matches.append(np.stack((sub_rows[pairs[:, 0]], sub_cols[pairs[:, 1]]), axis=1))
+    matched_iou.append(-cost[pairs[:, 0], pairs[:, 1]])
+
+  # whatever the sparse groups left over has zero IOU with the rest of its group
+  det_free = sparse[det_group]
+  trk_free = sparse[trk_group]
+  for pairs in matches:
+    det_free[pairs[:, 0]] = False
+    trk_free[pairs[:, 1]] = False
+  free_rows, free_cols = np.flatnonzero(det_free), np.flatnonzero(trk_free)
+  stride = len(detections) + len(trackers)
+  _, r, c = np.intersect1d(det_group[free_rows] * stride + rank_in_group(det_group[free_rows]),
+                           trk_group[free_cols] * stride + rank_in_group(trk_group[free_cols]),
+                           assume_unique=True, return_indices=True)
+  matches.append(np.stack((free_rows[r], free_cols[c]), axis=1))
+  matched_iou.append(np.zeros(len(r)))
+
+  det_order = np.argsort(det_group, kind='stable')
+  trk_order = np.argsort(trk_group, kind='stable')
+  det_split = np.cumsum(det_count)
+  trk_split = np.cumsum(trk_count)
+  for g in np.flatnonzero(dense & (det_count > 0) & (trk_count > 0)):
+    sub_rows = det_order[det_split[g] - det_count[g]:det_split[g]]
+    sub_cols = trk_order[trk_split[g] - trk_count[g]:trk_split[g]]
+    iou_matrix = iou_batch(detections[sub_rows], trackers[sub_cols])
+    pairs = np.asarray(linear_assignment(-iou_matrix), dtype=int).reshape(-1, 2)
+    matches.append(np.stack((sub_rows[pairs[:, 0]], sub_cols[pairs[:, 1]]), axis=1))
+    matched_iou.append(iou_matrix[pairs[:, 0], pairs[:, 1]])
+  matches, matched_iou = np.concatenate(matches), np.concatenate(matched_iou)
+  order = np.argsort(matches[:, 0], kind='stable')
+  return matches[order], matched_iou[order]
 
 
 def convert_bbox_to_z(bbox):
@@ -91,15 +286,48 @@ def convert_x_to_bbox(x,score=None):
     return np.array([x[0]-w/2.,x[1]-h/2.,x[0]+w/2.,x[1]+h/2.,score]).reshape((1,5))
 
 
+def convert_bboxes_to_z(bboxes):
+  """
+  Vectorised convert_bbox_to_z: takes (N,4+) boxes and returns (N,4) [x,y,s,r] rows.
+  """
+  bboxes = np.asarray(bboxes, dtype=float)
+  w = bboxes[:, 2] - bboxes[:, 0]
+  h = bboxes[:, 3] - bboxes[:, 1]
+  return np.stack([bboxes[:, 0] + w/2., bboxes[:, 1] + h/2., w * h, w / h], axis=1)
+
+
+def convert_x_to_bboxes(x, out=None):
+  """
+  Vectorised convert_x_to_bbox: takes (N,4+) centre form rows and returns (N,4) boxes,
+  written into `out` when given.
+  """
+  w = np.sqrt(x[:, 2] * x[:, 3])
+  h = x[:, 2] / w
+  if out is None:
+    out = np.empty((len(x), 4))
+  w /= 2.
+  h /= 2.
+  np.subtract(x[:, 0], w, out=out[:, 0])
+  np.subtract(x[:, 1], h, out=out[:, 1])
+  np.add(x[:, 0], w, out=out[:, 2])
+  np.add(x[:, 1], h, out=out[:, 3])
+  return out
+
+
 class KalmanBoxTracker(object):
   """
   This class represents the internal state of individual tracked objects observed as bbox.
   """
   count = 0
-  def __init__(self,bbox):
+  def __init__(self,bbox,history_size=64):
     """
     Initialises a tracker using initial bounding box.
+    The predictions since the last update are kept in a ring of history_size boxes.
     """
+    # filterpy (and scipy with it) is only needed by this per-track filter,
+    # not by Sort, which runs on KalmanBoxBatch
+    from filterpy.kalman import KalmanFilter
+
     #define constant velocity model
     self.kf = KalmanFilter(dim_x=7, dim_z=4) 
     self.kf.F = np.array([[1,0,0,0,1,0,0],[0,1,0,0,0,1,0],[0,0,1,0,0,0,1],[0,0,0,1,0,0,0],  [0,0,0,0,1,0,0],[0,0,0,0,0,1,0],[0,0,0,0,0,0,1]])
@@ -115,7 +343,7 @@ class KalmanBoxTracker(object):
     self.time_since_update = 0
     self.id = KalmanBoxTracker.count
     KalmanBoxTracker.count += 1
-    self.history = []
+    self.history = TrajectoryBuffer(history_size, track_id=self.id)
     self.hits = 0
     self.hit_streak = 0
     self.age = 0
@@ -125,7 +353,7 @@ class KalmanBoxTracker(object):
     Updates the state vector with observed bbox.
     """
     self.time_since_update = 0
-    self.history = []
+    self.history.clear()
     self.hits += 1
     self.hit_streak += 1
     self.kf.update(convert_bbox_to_z(bbox))
@@ -141,8 +369,9 @@ class KalmanBoxTracker(object):
     if(self.time_since_update>0):
       self.hit_streak = 0
     self.time_since_update += 1
-    self.history.append(convert_x_to_bbox(self.kf.x))
-    return self.history[-1]
+    bbox = convert_x_to_bbox(self.kf.x)
+    self.history.append(bbox[0])
+    return bbox
 
   def get_state(self):
     """
@@ -151,180 +380,297 @@ class KalmanBoxTracker(object):
     return convert_x_to_bbox(self.kf.x)
 
 
-def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3):
+class KalmanBoxBatch(object):
   """
-  Assigns detections to tracked object (both represented as bounding boxes)
+  The constant velocity Kalman filters of a set of tracks, stored as
+  struct-of-arrays: states in a (N,7) array and covariances in a (N,7,7) array,
+  so predict and update run as a handful of NumPy operations over every track
+  instead of one small filterpy call per track. The model and noise settings
+  are those of KalmanBoxTracker.
+  """
+  F = np.array([[1,0,0,0,1,0,0],[0,1,0,0,0,1,0],[0,0,1,0,0,0,1],[0,0,0,1,0,0,0],  [0,0,0,0,1,0,0],[0,0,0,0,0,1,0],[0,0,0,0,0,0,1]], dtype=float)
+  H = np.eye(4, 7)
+  R = np.diag([1., 1., 10., 10.])
+  Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+  P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+
+  def __init__(self, capacity=64):
+    self.n = 0
+    self._allocate(capacity)
+
+  def _allocate(self, capacity):
+    old = getattr(self, 'x', None)
+    self.boxes = np.empty((capacity, 4))
+    x = np.zeros((capacity, 7))
+    P = np.zeros((capacity, 7, 7))
+    counters = np.zeros((6, capacity), dtype=np.int64)
+    if old is not None:
+      x[:self.n] = self.x[:self.n]
+      P[:self.n] = self.P[:self.n]
+      counters[:, :self.n] = self.counters[:, :self.n]
+    self.x, self.P, self.counters = x, P, counters
+    self.id, self.hits, self.hit_streak, self.age, self.time_since_update, self.stream = counters
+
+  def __len__(self):
+    return self.n
+
+  def add(self, bboxes, ids, stream=0):
+    """
+    Starts a track for every bbox [x1,y1,x2,y2,...] with the given ids, tagged
+    with the index of the stream it belongs to.
+    """
+    k = len(bboxes)
+    if self.n + k > len(self.x):
+      self._allocate(max(2 * len(self.x), self.n + k))
+    new = slice(self.n, self.n + k)
+    self.x[new] = 0.
+    self.x[new, :4] = convert_bboxes_to_z(bboxes)
+    self.P[new] = self.P0
+    self.counters[:, new] = 0
+    self.id[new] = ids
+    self.stream[new] = stream
+    self.n += k
+
+  def keep(self, mask):
+    """
+    Drops the tracks where mask is False, keeping the others in order.
+    """
+    keep = np.flatnonzero(mask)
+    k = len(keep)
+    self.x[:k] = self.x[keep]
+    self.P[:k] = self.P[keep]
+    self.counters[:, :k] = self.counters[:, keep]
+    self.n = k
+
+  def predict(self, mask=None):
+    """
+    Advances every track, or only those where mask is True, and returns their
+    predicted boxes as a (N,4) array. The array is a view into a buffer that
+    the next predict() overwrites.
+    """
+    rows = slice(0, self.n) if mask is None else np.flatnonzero(mask)
+    x, P = self.x[rows], self.P[rows]
+    x[x[:, 6] + x[:, 2] <= 0, 6] = 0.
+    # F only adds the velocities to x, y and s, so x = Fx and P = FPF' + Q are
+    # done in place rather than as matrix products
+    x[:, :3] += x[:, 4:]
+    P[:, :3] += P[:, 4:]
+    P[:, :, :3] += P[:, :, 4:]
+    P += self.Q
+    if mask is not None:
+      self.x[rows] = x
+      self.P[rows] = P
+    self.age[rows] += 1
+    self.hit_streak[rows] *= self.time_since_update[rows] == 0
+    self.time_since_update[rows] += 1
+    return convert_x_to_bboxes(x, out=self.boxes[:len(x)])
+
+  def update(self, indices, bboxes):
+    """
+    Corrects the tracks at indices with their observed bboxes.
+    """
+    if not len(indices):
+      return
+    x, P = self.x[indices], self.P[indices]
+    y = convert_bboxes_to_z(bboxes) - x[:, :4]
+    PHT = P[:, :, :4]
+    S = PHT[:, :4] + self.R
+    K = PHT @ np.linalg.inv(S)
+    x += (K @ y[:, :, None])[:, :, 0]
+    I_KH = np.eye(7) - K @ self.H
+    self.x[indices] = x
+    self.P[indices] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+    self.time_since_update[indices] = 0
+    self.hits[indices] += 1
+    self.hit_streak[indices] += 1
+
+  def get_state(self, rows=None, out=None):
+    """
+    Returns the current bounding box estimates as a (N,4) array, of only the
+    tracks in `rows` when given, written into `out` when given.
+    """
+    x = self.x[:self.n] if rows is None else self.x[rows]
+    return convert_x_to_bboxes(x, out=out)
+
+  def snapshot(self):
+    """
+    Returns copies of the filter states, covariances and track counters.
+    """
+    return {'x': self.x[:self.n].copy(), 'P': self.P[:self.n].copy(), 'counters': self.counters[:, :self.n].copy()}
+
+  def restore(self, state):
+    n = len(state['x'])
+    if n > len(self.x):
+      self._allocate(n)
+    self.n = n
+    self.x[:n] = state['x']
+    self.P[:n] = state['P']
+    self.counters[:, :n] = state['counters']
 
-  Returns 3 lists of matches, unmatched_detections and unmatched_trackers
+
+def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3,max_dense_pairs=DENSE_MAX_PAIRS,groups=None,
+                                     tracker_groups=None):
+  """
+  Assigns detections to tracked object (both represented as bounding boxes)
+  Scenes with more than max_dense_pairs detection x tracker pairs, or split
+  into groups (see gated_assignment), are solved sparsely by gated_assignment
+  instead of over the dense IOU matrix.
+
+  Returns 3 lists of matches, unmatched_detections and unmatched_trackers.
+  Unmatched detections list those the solver left out first and those it
+  paired below the threshold after them, so new tracks are numbered in that
+  order.
   """
   if(len(trackers)==0):
     return np.empty((0,2),dtype=int), np.arange(len(detections)), np.empty((0,5),dtype=int)
 
-  iou_matrix = iou_batch(detections, trackers)
-
-  if min(iou_matrix.shape) > 0:
-    a = (iou_matrix > iou_threshold).astype(np.int32)
-    if a.sum(1).max() == 1 and a.sum(0).max() == 1:
-        matched_indices = np.stack(np.where(a), axis=1)
-    else:
-      matched_indices = linear_assignment(-iou_matrix)
+  if groups is not None or len(detections) * len(trackers) > max_dense_pairs:
+    matched_indices, matched_iou = gated_assignment(detections, trackers, iou_threshold, groups, tracker_groups,
+                                                    max_dense_pairs)
   else:
-    matched_indices = np.empty(shape=(0,2))
-
-  unmatched_detections = []
-  for d, det in enumerate(detections):
-    if(d not in matched_indices[:,0]):
-      unmatched_detections.append(d)
-  unmatched_trackers = []
-  for t, trk in enumerate(trackers):
-    if(t not in matched_indices[:,1]):
-      unmatched_trackers.append(t)
-
-  #filter out matched with low IOU
-  matches = []
-  for m in matched_indices:
-    if(iou_matrix[m[0], m[1]]<iou_threshold):
-      unmatched_detections.append(m[0])
-      unmatched_trackers.append(m[1])
+    iou_matrix = iou_batch(detections, trackers)
+
+    if min(iou_matrix.shape) > 0:
+      a = iou_matrix > iou_threshold
+      if a.sum(1).max() == 1 and a.sum(0).max() == 1:
+          matched_indices = np.stack(np.where(a), axis=1)
+      else:
+        matched_indices = linear_assignment(-iou_matrix)
     else:
-      matches.append(m.reshape(1,2))
-  if(len(matches)==0):
-    matches = np.empty((0,2),dtype=int)
-  else:
-    matches = np.concatenate(matches,axis=0)
+      matched_indices = np.empty(shape=(0,2))
+    matched_indices = np.asarray(matched_indices, dtype=int).reshape(-1, 2)
+    matched_iou = iou_matrix[matched_indices[:,0], matched_indices[:,1]]
+
+  det_matched = np.zeros(len(detections), dtype=bool)
+  det_matched[matched_indices[:,0]] = True
+  trk_matched = np.zeros(len(trackers), dtype=bool)
+  trk_matched[matched_indices[:,1]] = True
+  #filter out matched with low IOU
+  low_iou = matched_iou < iou_threshold
+  matches = matched_indices[~low_iou]
+  unmatched_detections = np.concatenate((np.flatnonzero(~det_matched), matched_indices[low_iou,0]))
+  unmatched_trackers = np.concatenate((np.flatnonzero(~trk_matched), matched_indices[low_iou,1]))
 
-  return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+  return matches, unmatched_detections, unmatched_trackers
 
 
 class Sort(object):
-  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, reuse_output=False):
     """
     Sets key parameters for SORT
+    Track ids are numbered per instance, so every tracker starts from id 1.
+    With reuse_output=True update() returns a view into a buffer owned by the
+    tracker, valid until the next update(), instead of a new array per frame.
     """
     self.max_age = max_age
     self.min_hits = min_hits
     self.iou_threshold = iou_threshold
-    self.trackers = []
+    self.tracks = KalmanBoxBatch()
     self.frame_count = 0
+    self.next_id = 0
+    self.output = np.empty((64, 5)) if reuse_output else None
 
-  def update(self, dets=np.empty((0, 5))):
+  def update(self, dets=np.empty((0, 5)), out=None):
     """
     Params:
       dets - a numpy array of detections in the format [[x1,y1,x2,y2,score],[x1,y1,x2,y2,score],...]
+      out - optional (M,5) array the result is written into; the returned
+            array is then a view of its first rows.
     Requires: this method must be called once for each frame even with empty detections (use np.empty((0, 5)) for frames without detections).
     Returns the a similar array, where the last column is the object ID.
 
     NOTE: The number of objects returned may differ from the number of detections provided.
     """
+    return self.correct(dets, self.predict(), out)
+
+  def predict(self):
+    """
+    First half of update(): starts a frame and returns the predicted boxes of
+    the tracks, dropping tracks whose prediction is invalid.
+    """
     self.frame_count += 1
+    tracks = self.tracks
     # get predicted locations from existing trackers.
-    trks = np.zeros((len(self.trackers), 5))
-    to_del = []
-    ret = []
-    for t, trk in enumerate(trks):
-      pos = self.trackers[t].predict()[0]
-      trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-      if np.any(np.isnan(pos)):
-        to_del.append(t)
-    trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
-    for t in reversed(to_del):
-      self.trackers.pop(t)
+    trks = tracks.predict()
+    valid = ~np.any(np.isnan(trks), axis=1)
+    if not valid.all():
+      tracks.keep(valid)
+      trks = trks[valid]
+    return trks
+
+  def correct(self, dets, trks, out=None):
+    """
+    Second half of update(): associates dets with the predicted boxes trks,
+    corrects and creates tracks and returns what update() returns.
+    """
+    tracks = self.tracks
+    confirmed = self.associate(dets, trks)
+    # reported newest first, as the per-track loop did
+    shown = np.flatnonzero(confirmed)[::-1]
+    ret = self._output(len(shown), out)
+    tracks.get_state(shown, out=ret[:, :4])
+    ret[:, 4] = tracks.id[shown] + 1 # +1 as MOT benchmark requires positive
+    self.prune()
+    return ret
+
+  def associate(self, dets, trks):
+    """
+    Matches dets with the predicted boxes trks, corrects the matched tracks
+    and starts new ones. Returns the mask of tracks update() reports.
+    """
+    tracks = self.tracks
     matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets,trks, self.iou_threshold)
 
     # update matched trackers with assigned detections
-    for m in matched:
-      self.trackers[m[1]].update(dets[m[0], :])
+    matched = np.asarray(matched, dtype=int)
+    tracks.update(matched[:, 1], dets[matched[:, 0], :4])
 
     # create and initialise new trackers for unmatched detections
-    for i in unmatched_dets:
-        trk = KalmanBoxTracker(dets[i,:])
-        self.trackers.append(trk)
-    i = len(self.trackers)
-    for trk in reversed(self.trackers):
-        d = trk.get_state()[0]
-        if (trk.time_since_update < 1) and (trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
-          ret.append(np.concatenate((d,[trk.id+1])).reshape(1,-1)) # +1 as MOT benchmark requires positive
-        i -= 1
-        # remove dead tracklet
-        if(trk.time_since_update > self.max_age):
-          self.trackers.pop(i)
-    if(len(ret)>0):
-      return np.concatenate(ret)
-    return np.empty((0,5))
-
-def parse_args():
-    """Parse input arguments."""
-    parser = argparse.ArgumentParser(description='SORT demo')
-    parser.add_argument('--display', dest='display', help='Display online tracker output (slow) [False]',action='store_true')
-    parser.add_argument("--seq_path", help="Path to detections.", type=str, default='data')
-    parser.add_argument("--phase", help="Subdirectory in seq_path.", type=str, default='train')
-    parser.add_argument("--max_age", 
-                        help="Maximum number of frames to keep alive a track without associated detections.", 
-                        type=int, default=1)
-    parser.add_argument("--min_hits", 
-                        help="Minimum number of associated detections before track is initialised.", 
-                        type=int, default=3)
-    parser.add_argument("--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3)
-    args = parser.parse_args()
-    return args
-
-if __name__ == '__main__':
-  # all train
-  args = parse_args()
-  display = args.display
-  phase = args.phase
-  total_time = 0.0
-  total_frames = 0
-  colours = np.random.rand(32, 3) #used only for display
-  if(display):
-    if not os.path.exists('mot_benchmark'):
-      print('\n\tERROR: mot_benchmark link not found!\n\n    Create a symbolic link to the MOT benchmark\n    (https://motchallenge.net/data/2D_MOT_2015/#download). E.g.:\n\n    $ ln -s /path/to/MOT2015_challenge/2DMOT2015 mot_benchmark\n\n')
-      exit()
-    plt.ion()
-    fig = plt.figure()
-    ax1 = fig.add_subplot(111, aspect='equal')
-
-  if not os.path.exists('output'):
-    os.makedirs('output')
-  pattern = os.path.join(args.seq_path, phase, '*', 'det', 'det.txt')
-  for seq_dets_fn in glob.glob(pattern):
-    mot_tracker = Sort(max_age=args.max_age, 
-                       min_hits=args.min_hits,
-                       iou_threshold=args.iou_threshold) #create instance of the SORT tracker
-    seq_dets = np.loadtxt(seq_dets_fn, delimiter=',')
-    seq = seq_dets_fn[pattern.find('*'):].split(os.path.sep)[0]
-    
-    with open(os.path.join('output', '%s.txt'%(seq)),'w') as out_file:
-      print("Processing %s."%(seq))
-      for frame in range(int(seq_dets[:,0].max())):
-        frame += 1 #detection and frame numbers begin at 1
-        dets = seq_dets[seq_dets[:, 0]==frame, 2:7]
-        dets[:, 2:4] += dets[:, 0:2] #convert to [x1,y1,w,h] to [x1,y1,x2,y2]
-        total_frames += 1
-
-        if(display):
-          fn = os.path.join('mot_benchmark', phase, seq, 'img1', '%06d.jpg'%(frame))
-          im =io.imread(fn)
-          ax1.imshow(im)
-          plt.title(seq + ' Tracked Targets')
-
-        start_time = time.time()
-        trackers = mot_tracker.update(dets)
-        cycle_time = time.time() - start_time
-        total_time += cycle_time
-
-        for d in trackers:
-          print('%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1'%(frame,d[4],d[0],d[1],d[2]-d[0],d[3]-d[1]),file=out_file)
-          if(display):
-            d = d.astype(np.int32)
-            ax1.add_patch(patches.Rectangle((d[0],d[1]),d[2]-d[0],d[3]-d[1],fill=False,lw=3,ec=colours[d[4]%32,:]))
-
-        if(display):
-          fig.canvas.flush_events()
-          plt.draw()
-          ax1.cla()
-
-  print("Total Tracking took: %.3f seconds for %d frames or %.1f FPS" % (total_time, total_frames, total_frames / total_time))
-
-  if(display):
-    print("Note: to get real runtime results run without the option: --display")
+    unmatched_dets = np.asarray(unmatched_dets, dtype=int)
+    tracks.add(dets[unmatched_dets, :4], self.next_id + np.arange(len(unmatched_dets)))
+    self.next_id += len(unmatched_dets)
+
+    n = len(tracks)
+    fresh = tracks.time_since_update[:n] < 1
+    return fresh & ((tracks.hit_streak[:n] >= self.min_hits) | (self.frame_count <= self.min_hits))
+
+  def prune(self):
+    """
+    Removes the tracks that have gone unmatched for more than max_age frames.
+    """
+    tracks = self.tracks
+    alive = tracks.time_since_update[:len(tracks)] <= self.max_age
+    if not alive.all():
+      tracks.keep(alive)
+
+  def _output(self, rows, out=None):
+    """
+    Returns the (rows,5) array update() writes its result into.
+    """
+    if out is not None:
+      if out.ndim != 2 or out.shape[0] < rows or out.shape[1] != 5:
+        raise ValueError("out must have shape (>=%d, 5), got %s" % (rows, out.shape))
+      return out[:rows]
+    if self.output is None:
+      return np.empty((rows, 5))
+    if len(self.output) < rows:
+      self.output = np.empty((max(rows, 2 * len(self.output)), 5))
+    return self.output[:rows]
+
+  def snapshot(self):
+    """
+    Returns the full tracker state as a flat dict of arrays, see checkpoint.py.
+    """
+    state = {'params': np.array([self.max_age, self.min_hits, self.iou_threshold]),
+             'counts': np.array([self.frame_count, self.next_id])}
+    state.update(self.tracks.snapshot())
+    return state
+
+  def restore(self, state):
+    """
+    Continues from a state returned by snapshot().
+    """
+    max_age, min_hits, self.iou_threshold = state['params']
+    self.max_age, self.min_hits = int(max_age), int(min_hits)
+    self.frame_count, self.next_id = (int(count) for count in state['counts'])
+    self.tracks.restore(state)
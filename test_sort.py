@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from sort import Sort, associate_detections_to_trackers, iou_batch, linear_assignment
+
+
+def crowded_frame(rng, num_trackers, num_detections, size=300.0):
+    """
+    Trackers and noisy detections of most of them, noisy enough that many
+    pairs overlap below the threshold, plus detections of nothing.
+    """
+    corner = rng.uniform(0, size, (num_trackers, 2))
+    trackers = np.hstack((corner, corner + rng.uniform(15, 40, (num_trackers, 2))))
+    seen = rng.choice(num_trackers, min(num_detections, num_trackers), replace=False)
+    extra = rng.uniform(0, size, (num_detections - len(seen), 2))
+    detections = np.vstack((trackers[seen] + rng.normal(0, 8, (len(seen), 4)), np.hstack((extra, extra + 20))))
+    detections[:, 2:] = np.maximum(detections[:, 2:], detections[:, :2] + 2)
+    return detections[rng.permutation(len(detections))], trackers
+
+
+def solver_order(detections, trackers, iou_threshold=0.3):
+    """
+    Unmatched detections as SORT has always listed them: those the solver
+    left out, then those it paired below the threshold.
+    """
+    iou_matrix = iou_batch(detections, trackers)
+    pairs = linear_assignment(-iou_matrix)
+    low = iou_matrix[pairs[:, 0], pairs[:, 1]] < iou_threshold
+    left_out = np.setdiff1d(np.arange(len(detections)), pairs[:, 0])
+    return np.concatenate((left_out, pairs[low, 0]))
+
+
+# two detections clash over tracker 0, so the solver runs; it pairs detection 2
+# with tracker 2 below the threshold and leaves detections 1 and 3 out
+TRACKERS = np.array([[0, 0, 10, 10], [100, 100, 110, 110], [200, 200, 210, 210]], dtype=float)
+DETECTIONS = np.array([[1, 0, 11, 10], [0, 2, 10, 12], [207, 207, 217, 217], [300, 300, 310, 310],
+                       [101, 101, 111, 111]], dtype=float)
+
+
+@pytest.mark.parametrize('max_dense_pairs', [10 ** 9, 0])
+def test_low_iou_rejects_come_last(max_dense_pairs):
+    matches, unmatched, _ = associate_detections_to_trackers(DETECTIONS, TRACKERS, max_dense_pairs=max_dense_pairs)
+    assert matches.tolist() == [[0, 0], [4, 1]]
+    assert unmatched.tolist() == [1, 3, 2]
+
+
+def test_new_tracks_numbered_in_unmatched_order():
+    tracker = Sort(max_age=1, min_hits=0)
+    tracker.update(np.hstack((TRACKERS, np.ones((3, 1)))))
+    ids = {tuple(row[:2]): row[4] for row in tracker.update(np.hstack((DETECTIONS, np.ones((5, 1)))))}
+    assert ids[(0, 2)] < ids[(300, 300)] < ids[(207, 207)]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_dense_path_keeps_solver_order(seed):
+    rng = np.random.default_rng(seed)
+    reordered = 0
+    for _ in range(100):
+        detections, trackers = crowded_frame(rng, int(rng.integers(1, 30)), int(rng.integers(1, 40)))
+        _, unmatched, _ = associate_detections_to_trackers(detections, trackers)
+        iou_matrix = iou_batch(detections, trackers)
+        strong = iou_matrix > 0.3
+        if strong.sum(1).max() == 1 and strong.sum(0).max() == 1:
+            continue
+        assert np.array_equal(unmatched, solver_order(detections, trackers))
+        reordered += not np.array_equal(unmatched, np.sort(unmatched))
+    assert reordered
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_groups_keep_the_dense_order(seed):
+    rng = np.random.default_rng(seed)
+    reordered = 0
+    for _ in range(50):
+        frames = [crowded_frame(rng, int(rng.integers(1, 30)), int(rng.integers(1, 40))) for _ in range(3)]
+        # groups side by side, far enough apart that none overlaps another
+        shift = np.array([1000., 0, 1000., 0])
+        detections = np.concatenate([dets + g * shift for g, (dets, _) in enumerate(frames)])
+        trackers = np.concatenate([trks + g * shift for g, (_, trks) in enumerate(frames)])
+        det_group = np.repeat(np.arange(3), [len(dets) for dets, _ in frames])
+        trk_group = np.repeat(np.arange(3), [len(trks) for _, trks in frames])
+        _, unmatched, _ = associate_detections_to_trackers(detections, trackers, groups=det_group,
+                                                           tracker_groups=trk_group)
+        first = np.concatenate(([0], np.cumsum([len(dets) for dets, _ in frames])))
+        for g, (dets, trks) in enumerate(frames):
+            _, expected, _ = associate_detections_to_trackers(dets, trks)
+            assert np.array_equal(unmatched[det_group[unmatched] == g] - first[g], expected)
+            reordered += not np.array_equal(expected, np.sort(expected))
+    assert reordered
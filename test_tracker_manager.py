@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from sort import Sort
+from tracker_manager import TrackerManager
+
+
+def random_scene(rng, objects, frames, size=400.0):
+    """
+    Boxes drifting across a small field, so many of them overlap, with
+    missed detections, false alarms and shuffled row order.
+    """
+    corner = rng.uniform(0, size, (objects, 2))
+    extent = rng.uniform(10, 40, (objects, 2))
+    velocity = rng.normal(0, 4, (objects, 2))
+    scene = []
+    for _ in range(frames):
+        corner += velocity + rng.normal(0, 1, (objects, 2))
+        boxes = np.hstack((corner, corner + extent, np.ones((objects, 1))))[rng.random(objects) > 0.15]
+        noise = rng.uniform(0, size, (rng.integers(0, 4), 2))
+        boxes = np.vstack((boxes, np.hstack((noise, noise + 20, np.ones((len(noise), 1))))))
+        scene.append(boxes[rng.permutation(len(boxes))])
+    return scene
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_matches_separate_sort_instances(seed):
+    rng = np.random.default_rng(seed)
+    max_age, min_hits = int(rng.integers(1, 4)), int(rng.integers(0, 3))
+    scenes = {'cam%d' % i: random_scene(rng, int(rng.integers(0, 25)), 30) for i in range(4)}
+    manager = TrackerManager(max_age=max_age, min_hits=min_hits)
+    trackers = {name: Sort(max_age=max_age, min_hits=min_hits) for name in scenes}
+
+    for frame in range(30):
+        # some streams skip a tick now and then
+        detections = {name: scene[frame] for name, scene in scenes.items() if rng.random() > 0.2}
+        results = manager.update({name: dets.copy() for name, dets in detections.items()})
+        assert sorted(results) == sorted(detections)
+        for name, dets in detections.items():
+            expected = trackers[name].update(dets.copy())
+            assert np.array_equal(results[name][:, 4], expected[:, 4]), (name, frame)
+            np.testing.assert_allclose(results[name][:, :4], expected[:, :4], rtol=1e-9, atol=1e-6)
+
+
+def test_new_tracks_numbered_like_sort():
+    first = np.array([[0, 0, 10, 10, 1], [100, 100, 110, 110, 1]], dtype=float)
+    second = np.array([[8, 8, 18, 18, 1], [300, 300, 310, 310, 1]], dtype=float)
+    manager = TrackerManager(max_age=1, min_hits=0)
+    tracker = Sort(max_age=1, min_hits=0)
+    for dets in (first, second):
+        results = manager.update({'a': dets.copy(), 'b': dets.copy()})
+        expected = tracker.update(dets.copy())
+        for name in 'ab':
+            assert np.array_equal(results[name][:, 4], expected[:, 4])
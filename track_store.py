@@ -0,0 +1,191 @@
+"""
+Compact storage for the per-frame output of the vehicle trackers.
+
+Rows are fixed-width numbers, so they are kept in preallocated numpy chunks
+rather than Python lists of tuples, and can be streamed to the boundary CSV
+a chunk at a time while a run is in progress.
+"""
+import csv
+import os
+import shutil
+
+import numpy as np
+
+ROAD_HEADER = ["Vehicle_ID", "Initial_BBox", "Current_BBox"]
+# what separates the frame rows from the road rows, as csv.writer writes it
+ROAD_TRAILER = '\r\n' + ','.join(ROAD_HEADER) + '\r\n'
+
+
+class ColumnLog(object):
+    """
+    Append-only table of `width` columns gathered in chunks of `chunk` rows.
+    Without a sink every full chunk is kept; with one, each chunk is handed
+    to sink(rows) when it fills or on flush() and then reused, so memory
+    stays at one chunk however long the run.
+    """
+
+    def __init__(self, width, dtype=float, chunk=4096, sink=None):
+        self.width = width
+        self.chunk = np.empty((chunk, width), dtype=dtype)
+        self.chunks = []
+        self.pending = 0
+        self.total = 0
+        self.sink = sink
+
+    def append(self, row):
+        self.extend(row)
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self.chunk.dtype).reshape(-1, self.width)
+        while len(rows):
+            take = min(len(rows), len(self.chunk) - self.pending)
+            self.chunk[self.pending:self.pending + take] = rows[:take]
+            self.pending += take
+            self.total += take
+            rows = rows[take:]
+            if self.pending == len(self.chunk):
+                self.flush()
+
+    def flush(self):
+        """
+        Hands the gathered rows to the sink; without one only a full chunk is
+        set aside.
+        """
+        if self.sink is not None:
+            if self.pending:
+                self.sink(self.chunk[:self.pending])
+            self.pending = 0
+        elif self.pending == len(self.chunk):
+            self.chunks.append(self.chunk)
+            self.chunk = np.empty_like(self.chunk)
+            self.pending = 0
+
+    def array(self):
+        """
+        Returns the rows held in memory, all of them unless a sink was set.
+        """
+        return np.concatenate(self.chunks + [self.chunk[:self.pending]])
+
+    def __len__(self):
+        return self.total
+
+
+def write_frame_rows(writer, rows):
+    """
+    Writes (frame, min_left, max_left, min_right, max_right) rows, NaN
+    extents as empty fields.
+    """
+    for row in rows.tolist():
+        writer.writerow([int(row[0])] + ['' if value != value else value for value in row[1:]])
+
+
+def write_boundaries_csv(fp, frame_rows, road_rows):
+    """
+    Writes the boundary CSV: one row per frame, an empty row, the road header
+    and one (id, x1, y1, x2, y2) row per vehicle per frame.
+    """
+    writer = csv.writer(fp)
+    write_frame_rows(writer, np.asarray(frame_rows, dtype=float).reshape(-1, 5))
+    fp.write(ROAD_TRAILER)
+    writer.writerows(np.asarray(road_rows, dtype=np.int64).reshape(-1, 5).tolist())
+
+
+class BoundaryLog(object):
+    """
+    The two tables a vehicle tracker produces: per-frame extents `frames`
+    (frame, min_left, max_left, min_right, max_right), NaN before any
+    vehicle is seen, and per-vehicle boxes `roads` (id, x1, y1, x2, y2).
+
+    After stream(path) rows go to the boundary CSV at `path` as chunks fill;
+    the road rows wait in `path`.roads until close() appends them after the
+    frame rows.
+    """
+
+    def __init__(self, chunk=4096):
+        self.frames = ColumnLog(5, float, chunk)
+        self.roads = ColumnLog(5, np.int64, chunk)
+        self.path = None
+        self.files = None
+        self.resume_offsets = None
+
+    def stream(self, path):
+        """
+        Starts writing to `path`, first the rows already logged. A log
+        restored from a checkpoint taken while streaming continues the files
+        it was writing, cut back to where the checkpoint was taken.
+        """
+        self.path = path
+        if self.resume_offsets is not None:
+            if not os.path.exists(path + '.roads'):  # the run had finished; split its CSV up again
+                with open(path, newline='') as fp:
+                    fp.seek(self.resume_offsets[0])
+                    roads = fp.read()[len(ROAD_TRAILER):]
+                with open(path + '.roads', 'w', newline='') as fp:
+                    fp.write(roads)
+            self.files = [open(name, 'r+', newline='') for name in (path, path + '.roads')]
+            for fp, offset in zip(self.files, self.resume_offsets):
+                fp.seek(offset)
+                fp.truncate()
+            self.resume_offsets = None
+        else:
+            self.files = [open(name, 'w', newline='') for name in (path, path + '.roads')]
+        frame_writer, road_writer = (csv.writer(fp) for fp in self.files)
+        for log, sink in ((self.frames, lambda rows: write_frame_rows(frame_writer, rows)),
+                          (self.roads, lambda rows: road_writer.writerows(rows.tolist()))):
+            for rows in log.chunks:
+                sink(rows)
+            log.chunks = []
+            log.sink = sink
+            log.flush()
+
+    def close(self):
+        """
+        Finishes a streamed CSV. Raises ValueError for a log restored from a
+        streaming checkpoint that was never streamed again, as its earlier
+        rows are only in that CSV.
+        """
+        if self.resume_offsets is not None:
+            raise ValueError("the log was restored from a checkpoint taken while streaming and must be "
+                             "resumed by stream() to the same CSV")
+        if self.files is None:
+            return
+        self.frames.flush()
+        self.roads.flush()
+        frame_fp, road_fp = self.files
+        road_fp.close()
+        frame_fp.write(ROAD_TRAILER)
+        with open(self.path + '.roads', newline='') as road_fp:
+            shutil.copyfileobj(road_fp, frame_fp)
+        frame_fp.close()
+        os.remove(self.path + '.roads')
+        self.files = None
+
+    def snapshot(self):
+        """
+        Returns the log as a flat dict of arrays. While streaming, the files
+        are flushed and only their lengths are kept.
+        """
+        if self.files is None:
+            return {'frame_rows': self.frames.array(), 'road_rows': self.roads.array(),
+                    'offsets': np.array([-1, -1]), 'totals': np.array([len(self.frames), len(self.roads)])}
+        self.frames.flush()
+        self.roads.flush()
+        for fp in self.files:
+            fp.flush()
+        return {'frame_rows': np.empty((0, 5)), 'road_rows': np.empty((0, 5), dtype=np.int64),
+                'offsets': np.array([fp.tell() for fp in self.files]),
+                'totals': np.array([len(self.frames), len(self.roads)])}
+
+    def restore(self, state):
+        """
+        Continues from a state returned by snapshot(); one taken while
+        streaming must be resumed by stream() to the same path, or close()
+        raises.
+        """
+        self.frames = ColumnLog(5, float, len(self.frames.chunk))
+        self.roads = ColumnLog(5, np.int64, len(self.roads.chunk))
+        self.frames.extend(state['frame_rows'])
+        self.roads.extend(state['road_rows'])
+        self.frames.total, self.roads.total = (int(total) for total in state['totals'])
+        offsets = [int(offset) for offset in state['offsets']]
+        self.resume_offsets = offsets if offsets[0] >= 0 else None
@@ -0,0 +1,122 @@
+import numpy as np
+
+from sort import KalmanBoxBatch, associate_detections_to_trackers
+
+
+class TrackerManager(object):
+    """
+    Hosts one SORT tracker per camera stream in a single process.
+
+    The tracks of every stream live in one KalmanBoxBatch tagged with their
+    stream index, so each tick predicts all of them in one vectorised call.
+    Association is one gated call as well: every stream's boxes are shifted
+    into a strip of their own along x, so boxes of different streams never
+    overlap and can never be matched, and the streams are passed as groups so
+    each is matched as if on its own. Track ids are numbered per stream from
+    1, as a separate Sort instance would number them.
+    """
+
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.tracks = KalmanBoxBatch()
+        self.index = {}
+        self.names = []
+        self.frame_count = np.zeros(0, dtype=np.int64)
+        self.next_id = np.zeros(0, dtype=np.int64)
+
+    def add_stream(self, name):
+        if name in self.index:
+            raise ValueError("stream %r is already registered" % (name,))
+        self.index[name] = len(self.names)
+        self.names.append(name)
+        self.frame_count = np.append(self.frame_count, 0)
+        self.next_id = np.append(self.next_id, 0)
+
+    def remove_stream(self, name):
+        """
+        Drops the stream's tracks; its name can be registered again later and
+        then starts over from id 1.
+        """
+        stream = self.index.pop(name)
+        self.tracks.keep(self.tracks.stream[:len(self.tracks)] != stream)
+        self.names[stream] = None
+        self.frame_count[stream] = 0
+        self.next_id[stream] = 0
+
+    def update(self, detections):
+        """
+        Advances every stream in `detections`, a dict mapping stream names to
+        arrays of detections in the format of Sort.update; unknown names are
+        registered on the fly. Streams left out of the dict do not advance.
+
+        Returns a dict mapping the same names to what Sort.update would have
+        returned for them.
+        """
+        for name in detections:
+            if name not in self.index:
+                self.add_stream(name)
+        names = list(detections)
+        streams = np.array([self.index[name] for name in names], dtype=np.int64)
+        self.frame_count[streams] += 1
+        dets = [np.asarray(detections[name], dtype=float).reshape(-1, 5) for name in names]
+        det_stream = np.repeat(streams, [len(d) for d in dets])
+        dets = np.concatenate(dets) if dets else np.empty((0, 5))
+
+        tracks = self.tracks
+        ticking = np.zeros(len(self.names), dtype=bool)
+        ticking[streams] = True
+        # get predicted locations from the existing trackers of these streams.
+        trks = tracks.predict(ticking[tracks.stream[:len(tracks)]])
+        valid = ~np.any(np.isnan(trks), axis=1)
+        if not valid.all():
+            keep = np.ones(len(tracks), dtype=bool)
+            keep[np.flatnonzero(ticking[tracks.stream[:len(tracks)]])[~valid]] = False
+            tracks.keep(keep)
+            trks = trks[valid]
+        rows = np.flatnonzero(ticking[tracks.stream[:len(tracks)]])
+        trk_stream = tracks.stream[rows]
+
+        # one strip per stream, wider than all boxes together so none reaches the next strip
+        boxes = np.concatenate((dets[:, :4], trks))
+        width = boxes[:, 2].max() - boxes[:, 0].min() + 1.0 if len(boxes) else 0.0
+        strip = np.zeros(len(self.names))
+        strip[streams] = np.arange(len(streams)) * width
+        shifted_dets = dets[:, :4] + strip[det_stream, None] * [1, 0, 1, 0]
+        shifted_trks = trks + strip[trk_stream, None] * [1, 0, 1, 0]
+        matched, unmatched_dets, _ = associate_detections_to_trackers(shifted_dets, shifted_trks, self.iou_threshold,
+                                                                     groups=det_stream, tracker_groups=trk_stream)
+
+        # update matched trackers with assigned detections
+        matched = np.asarray(matched, dtype=int)
+        tracks.update(rows[matched[:, 1]], dets[matched[:, 0], :4])
+
+        # create and initialise new trackers, numbering them within their stream
+        unmatched_dets = np.asarray(unmatched_dets, dtype=int)
+        new_stream = det_stream[unmatched_dets]
+        order = np.argsort(new_stream, kind='stable')
+        counts = np.bincount(new_stream, minlength=len(self.names))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - (np.cumsum(counts) - counts)[new_stream[order]]
+        tracks.add(dets[unmatched_dets, :4], self.next_id[new_stream] + rank, new_stream)
+        self.next_id += counts
+
+        n = len(tracks)
+        stream = tracks.stream[:n]
+        fresh = ticking[stream] & (tracks.time_since_update[:n] < 1)
+        confirmed = fresh & ((tracks.hit_streak[:n] >= self.min_hits) | (self.frame_count[stream] <= self.min_hits))
+        # reported newest first within each stream, as Sort does
+        shown = np.flatnonzero(confirmed)[::-1]
+        shown = shown[np.argsort(stream[shown], kind='stable')]
+        ret = np.empty((len(shown), 5))
+        tracks.get_state(shown, out=ret[:, :4])
+        ret[:, 4] = tracks.id[shown] + 1
+        splits = np.searchsorted(stream[shown], streams, side='left'), np.searchsorted(stream[shown], streams, side='right')
+        results = {name: ret[start:end] for name, start, end in zip(names, *splits)}
+
+        # remove dead tracklets
+        alive = tracks.time_since_update[:n] <= self.max_age
+        if not alive.all():
+            tracks.keep(alive)
+        return results
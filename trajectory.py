@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class TrajectorySpill(object):
+    """
+    Append-only file of full-resolution trajectory points shared by many
+    tracks. Every point is a float64 record (track_id, index, box...) where
+    index counts the points of that track from 0; records are gathered in a
+    preallocated chunk and written out a chunk at a time. Read it back with
+    load_spill().
+    """
+
+    def __init__(self, path, width=4, chunk=4096):
+        self.path = path
+        self.fp = open(path, 'ab')
+        self.chunk = np.empty((chunk, 2 + width))
+        self.pending = 0
+
+    def write(self, track_id, index, box):
+        if self.pending == len(self.chunk):
+            self.flush()
+        record = self.chunk[self.pending]
+        record[0] = track_id
+        record[1] = index
+        record[2:] = box
+        self.pending += 1
+
+    def flush(self):
+        self.chunk[:self.pending].tofile(self.fp)
+        self.pending = 0
+        self.fp.flush()
+
+    def close(self):
+        if not self.fp.closed:
+            self.flush()
+            self.fp.close()
+
+
+def load_spill(path, width=4):
+    """
+    Returns the spilled records as a (N, 2 + width) array of
+    (track_id, index, box...) rows in the order they were written.
+    """
+    return np.fromfile(path, dtype=np.float64).reshape(-1, 2 + width)
+
+
+class TrajectoryBuffer(object):
+    """
+    The most recent `capacity` boxes of one track in a preallocated ring, so
+    a long-lived track costs the same memory on its millionth frame as on its
+    hundredth. With a TrajectorySpill every box is also written there at full
+    resolution before it can be overwritten.
+    """
+    __slots__ = ('boxes', 'start', 'size', 'total', 'track_id', 'spill')
+
+    def __init__(self, capacity=256, width=4, track_id=-1, spill=None):
+        self.boxes = np.empty((capacity, width))
+        self.start = 0
+        self.size = 0
+        self.total = 0
+        self.track_id = track_id
+        self.spill = spill
+
+    def append(self, box):
+        capacity = len(self.boxes)
+        if self.size < capacity:
+            self.boxes[(self.start + self.size) % capacity] = box
+            self.size += 1
+        else:
+            self.boxes[self.start] = box
+            self.start = (self.start + 1) % capacity
+        if self.spill is not None:
+            self.spill.write(self.track_id, self.total, box)
+        self.total += 1
+
+    def extend(self, boxes):
+        for box in boxes:
+            self.append(box)
+
+    def clear(self):
+        self.start = self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("trajectory index out of range")
+        return self.boxes[(self.start + index) % len(self.boxes)]
+
+    def array(self):
+        """
+        Returns the buffered boxes oldest first as a (len, width) array; it is
+        a view into the ring when the boxes do not wrap around its end.
+        """
+        end = self.start + self.size
+        if end <= len(self.boxes):
+            return self.boxes[self.start:end]
+        return np.concatenate((self.boxes[self.start:], self.boxes[:end - len(self.boxes)]))